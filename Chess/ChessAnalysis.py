@@ -0,0 +1,292 @@
+"""
+responsible for analysing finished games: every position of a move log is searched on a pool of worker processes,
+each move is annotated with the evaluation before and after it, the engine's best move and a judgement
+(best, good, inaccuracy, mistake or blunder), and the games are written out as JSON lines or annotated PGN.
+positions are searched once per run however often they occur: results are cached by position in the parent,
+so openings shared between games and transpositions inside a game are only sent to a worker the first time.
+run from the project root with: python -m Chess.ChessAnalysis games.pgn --depth 3 --workers 8 --format pgn
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import ChessEngine, ChessPgn, ChessSearch
+
+#centipawns lost by a move, compared with the engine's best move, from which it gets each judgement
+JUDGEMENTS = ((300, "blunder", "$4"), (100, "mistake", "$2"), (50, "inaccuracy", "$6"))
+BEST_MARGIN = 10 #a move within this many centipawns of the best move counts as best
+#mate scores are capped to this when working out the centipawns lost, so losing a mate in 3 for a mate in 5 is no blunder
+LOSS_CAP = 1000
+
+#the searcher of a worker process, kept between tasks so its transposition table is reused
+_worker_searcher = None
+
+
+def _evaluate_task(packed_positions, max_depth, node_limit, tt_size_mb):
+    global _worker_searcher
+    if _worker_searcher is None:
+        _worker_searcher = ChessSearch.Searcher(tt_size_mb)
+    results = []
+    for packed in packed_positions:
+        result = _worker_searcher.search(ChessEngine.GameState.from_bytes(packed), max_depth, node_limit=node_limit)
+        results.append((result.score, result.best_move.move_id if result.best_move is not None else 0))
+    return results
+
+'''
+replays a move log from start (a GameState, the initial position if None) without touching the game it came from
+yields (GameState, move) before each move is made, the GameState is shared and changes as the replay goes on
+'''
+def replay(moves, start=None):
+    gs = ChessEngine.GameState.from_bytes(start.to_bytes()) if start is not None else ChessEngine.GameState()
+    for move in moves:
+        legal_move = gs.get_valid_moves().get(move.move_id)
+        if legal_move is None:
+            raise ValueError("move %d %s is not legal in %s" % (len(gs.moveLog), move.get_chess_notation(),
+                                                              gs.get_fen()))
+        yield gs, legal_move
+        gs.make_move(legal_move)
+
+'''
+the packed position before every move of the log and after the last one
+'''
+def log_positions(moves, start=None):
+    positions = []
+    gs = None
+    for gs, move in replay(moves, start):
+        positions.append(gs.to_bytes())
+    if gs is not None: #the replay has made the last move once the loop is done
+        positions.append(gs.to_bytes())
+    else:
+        positions.append(start.to_bytes() if start is not None else ChessEngine.GameState().to_bytes())
+    return positions
+
+'''
+a score from ChessSearch for display: pawns, or #n / #-n for a mate in n moves
+'''
+def format_score(score):
+    if abs(score) >= ChessSearch.MATE_THRESHOLD:
+        moves = (ChessSearch.MATE_SCORE - abs(score) + 1) // 2
+        return "#%d" % moves if score > 0 else "#-%d" % moves
+    return "%.2f" % (score / 100)
+
+def judge(loss):
+    for threshold, judgement, nag in JUDGEMENTS:
+        if loss >= threshold:
+            return judgement, nag
+    return ("best" if loss <= BEST_MARGIN else "good"), None
+
+
+class AnalysisGame():
+    def __init__(self, moves, start=None, headers=None, result="*"):
+        self.moves = moves #Move objects, e.g. a GameState.moveLog
+        self.start = start #GameState the moves are played from, None for the initial position
+        self.headers = headers if headers is not None else {}
+        self.result = result
+
+    '''
+    the moves of a PgnGame up to its first illegal or unsupported one, raises ValueError if its FEN tag is not legal
+    '''
+    @classmethod
+    def from_pgn(cls, game):
+        gs = ChessEngine.GameState()
+        start = None
+        if game.headers.get("FEN"):
+            gs.load_fen(game.headers["FEN"])
+            start = ChessEngine.GameState.from_bytes(gs.to_bytes())
+        for san in game.moves:
+            try:
+                gs.make_move(ChessPgn.san_to_move(gs, san))
+            except ChessPgn.SanError:
+                break
+        return cls(gs.moveLog, start, game.headers, game.result)
+
+
+class Analyser():
+    '''
+    holds the process pool and the result cache, so both are kept for every game of a run
+    use it as a context manager or call close
+    '''
+    def __init__(self, max_depth=3, node_limit=None, workers=None, batch_size=64, cache_size=1 << 18,
+                 tt_size_mb=16):
+        self.max_depth = max_depth
+        self.node_limit = node_limit
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.tt_size_mb = tt_size_mb
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.cache = OrderedDict() #packed position -> (score, best move id), least recently used first
+        self.cache_size = cache_size
+        self.in_flight = {} #packed position -> (future, index in its batch), for positions sent but not back yet
+        self.hits = 0
+        self.searched = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    '''
+    sends the positions of a game that are neither cached nor already being searched to the workers
+    '''
+    def submit(self, game):
+        positions = log_positions(game.moves, game.start)
+        batch = []
+        for packed in positions:
+            if packed in self.cache or packed in self.in_flight or packed in batch:
+                self.hits += 1
+                continue
+            batch.append(packed)
+            if len(batch) == self.batch_size:
+                self.submit_batch(batch)
+                batch = []
+        if batch:
+            self.submit_batch(batch)
+        return game, positions
+
+    def submit_batch(self, batch):
+        future = self.executor.submit(_evaluate_task, batch, self.max_depth, self.node_limit, self.tt_size_mb)
+        for i, packed in enumerate(batch):
+            self.in_flight[packed] = (future, i)
+        self.searched += len(batch)
+
+    '''
+    (score, best move id) of a submitted position, waiting for its worker if it is not back yet
+    '''
+    def evaluation(self, packed):
+        if packed not in self.in_flight and packed not in self.cache: #pushed out of the cache since it was submitted
+            self.submit_batch([packed])
+        if packed in self.in_flight:
+            future, i = self.in_flight.pop(packed)
+            self.cache[packed] = future.result()[i]
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(packed)
+        return self.cache[packed]
+
+    '''
+    the annotated game as a dict once its positions are searched:
+    every move has its SAN, the evaluation before and after it for the side that played it, the engine's best move,
+    the centipawns lost against the best move and the judgement, scores are also given from white's side as "eval"
+    '''
+    def finish(self, game, positions):
+        evaluations = [self.evaluation(packed) for packed in positions]
+        annotated = []
+        totals = {"w": [0, 0], "b": [0, 0]} #centipawns lost and moves for each side
+        counts = {"w": {}, "b": {}}
+        for ply, (gs, move) in enumerate(replay(game.moves, game.start)):
+            side = "w" if gs.whiteToMove else "b"
+            score_before, best_id = evaluations[ply]
+            score_after = -evaluations[ply + 1][0] #for the side that moved
+            loss = max(0, min(score_before, LOSS_CAP) - min(max(score_after, -LOSS_CAP), LOSS_CAP))
+            if move.move_id == best_id:
+                loss = 0
+            judgement, nag = judge(loss)
+            best = gs.get_valid_moves().get(best_id)
+            annotated.append({"ply": ply, "move": move.get_chess_notation(), "san": ChessPgn.move_to_san(gs, move),
+                              "before": score_before, "after": score_after,
+                              "eval": score_after if side == "w" else -score_after,
+                              "best": ChessPgn.move_to_san(gs, best) if best is not None else None,
+                              "loss": loss, "judgement": judgement, "nag": nag})
+            totals[side][0] += loss
+            totals[side][1] += 1
+            counts[side][judgement] = counts[side].get(judgement, 0) + 1
+        summary = {side: dict(counts[side], average_loss=round(totals[side][0] / totals[side][1], 1)
+                              if totals[side][1] else 0.0) for side in ("w", "b")}
+        return {"white": game.headers.get("White", "?"), "black": game.headers.get("Black", "?"),
+                "result": game.result, "moves": annotated, "summary": summary}
+
+    '''
+    analyses one game and returns the annotated dict, see finish
+    '''
+    def analyse(self, game):
+        return self.finish(*self.submit(game))
+
+    '''
+    analyses many games and yields (game, annotated dict) in order as they are done,
+    a few games per worker are in flight at once so the pool stays busy while the finished ones are written out
+    '''
+    def analyse_games(self, games):
+        pending = deque()
+        for game in games:
+            pending.append(self.submit(game))
+            while len(pending) > self.workers * 2:
+                game, positions = pending.popleft()
+                yield game, self.finish(game, positions)
+        while pending:
+            game, positions = pending.popleft()
+            yield game, self.finish(game, positions)
+
+
+'''
+the annotated game as PGN, with the white side evaluation after each move as an [%eval] comment,
+a NAG and the engine's move for inaccuracies, mistakes and blunders
+'''
+def annotated_pgn(game, analysis):
+    annotations = []
+    for entry in analysis["moves"]:
+        comment = "[%%eval %s]" % format_score(entry["eval"])
+        if entry["nag"]:
+            comment = "%s {%s %s, %s was best}" % (entry["nag"], comment, entry["judgement"].capitalize(), entry["best"])
+        else:
+            comment = "{%s}" % comment
+        annotations.append(comment)
+    return ChessPgn.write_pgn(game.moves, game.headers, game.result,
+                              game.start.get_fen() if game.start is not None else None, annotations)
+
+
+'''
+the games of a PGN file as AnalysisGames, a game whose FEN tag is not legal is left out with a note on stderr
+'''
+def read_games(path):
+    for number, game in enumerate(ChessPgn.read_pgn(path)):
+        try:
+            yield AnalysisGame.from_pgn(game)
+        except ValueError as e:
+            print("game %d left out: %s" % (number, e), file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="annotate every move of the games in a PGN file")
+    parser.add_argument("pgn", help="PGN file to analyse")
+    parser.add_argument("--depth", type=int, default=3, help="search depth per position")
+    parser.add_argument("--nodes", type=int, default=None, help="node budget per position")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--format", choices=("json", "pgn"), default="json")
+    parser.add_argument("--output", default="-", help="output file, - for stdout")
+    args = parser.parse_args(argv)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    games = plies = 0
+    start = time.perf_counter()
+    try:
+        with Analyser(args.depth, args.nodes, args.workers) as analyser:
+            for game, analysis in analyser.analyse_games(read_games(args.pgn)):
+                if args.format == "json":
+                    analysis["game"] = games
+                    output.write(json.dumps(analysis) + "\n")
+                else:
+                    output.write(annotated_pgn(game, analysis) + "\n")
+                output.flush()
+                games += 1
+                plies += len(analysis["moves"])
+            hits, searched = analyser.hits, analyser.searched
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    seconds = time.perf_counter() - start
+    print("%d games, %d moves in %.2fs (%.1f moves/s), %d positions searched, %d repeats taken from the cache" % (
+        games, plies, seconds, plies / seconds if seconds else 0.0, searched, hits), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
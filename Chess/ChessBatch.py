@@ -0,0 +1,153 @@
+"""
+responsible for turning many positions into NumPy arrays at once and computing evaluation features over the whole batch,
+a batch is an int8 array of N x 64 piece codes (ChessEngine.PIECE_CODES, squares in GameState.square_codes order)
+with a bool array of N sides to move, every feature below is a handful of array operations over all N positions.
+"""
+import numpy as np
+
+from Chess import ChessEngine, ChessSearch
+
+#codes of the pieces in ChessEngine.PIECES order, the columns of piece_planes and mobility
+PIECE_CODES = np.array([ChessEngine.PIECE_CODES[piece] for piece in ChessEngine.PIECES], dtype=np.int8)
+MOBILITY_FEATURES = ChessEngine.PIECES
+
+#material of the piece with each code, positive for white and negative for black
+MATERIAL_TABLE = np.zeros(13, dtype=np.int32)
+#material plus piece-square value of each code on each square, signed like MATERIAL_TABLE
+SQUARE_TABLE = np.zeros((13, 64), dtype=np.int32)
+for _piece in ChessEngine.PIECES:
+    _sign = 1 if _piece[0] == "w" else -1
+    MATERIAL_TABLE[ChessEngine.PIECE_CODES[_piece]] = _sign * ChessSearch.PIECE_VALUES[_piece[1]]
+    SQUARE_TABLE[ChessEngine.PIECE_CODES[_piece]] = [_sign * value for value in ChessSearch.SQUARE_VALUES[_piece]]
+
+FULL = np.uint64(ChessEngine.FULL_BOARD)
+#squares a step of dc columns can land on without wrapping around the board edge
+COLUMN_MASKS = {
+    0: FULL,
+    1: np.uint64(ChessEngine.FULL_BOARD ^ ChessEngine.FILE_A),
+    2: np.uint64(ChessEngine.FULL_BOARD ^ ChessEngine.FILE_A ^ (ChessEngine.FILE_A << 1)),
+    -1: np.uint64(ChessEngine.FULL_BOARD ^ ChessEngine.FILE_H),
+    -2: np.uint64(ChessEngine.FULL_BOARD ^ ChessEngine.FILE_H ^ (ChessEngine.FILE_H >> 1)),
+}
+SECOND_RANK = {"w": np.uint64(0xFF << 40), "b": np.uint64(0xFF << 16)} #where pawns land after a first 1 square move
+_POPCOUNT_TABLE = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+'''
+positions packed by GameState.to_bytes to (codes, white_to_move), the fastest way to build a batch
+'''
+def encode_packed(packed_positions):
+    data = np.frombuffer(b"".join(packed_positions), dtype=np.uint8).reshape(-1, 33)
+    codes = np.empty((len(data), 64), dtype=np.int8)
+    codes[:, 0::2] = data[:, :32] & 15
+    codes[:, 1::2] = data[:, :32] >> 4
+    return codes, data[:, 32] == 1
+
+'''
+GameState objects to (codes, white_to_move)
+'''
+def encode_positions(states):
+    return encode_packed([gs.to_bytes() for gs in states])
+
+'''
+every position of a game as (codes, white_to_move): the start position and the one after each move,
+moves is a list of Move objects played from start (a GameState, the initial position if None), e.g. a moveLog
+'''
+def encode_game(moves, start=None):
+    start = start if start is not None else ChessEngine.GameState()
+    codes = np.empty((len(moves) + 1, 64), dtype=np.int8)
+    codes[0] = start.square_codes
+    for i, move in enumerate(moves):
+        row = codes[i + 1]
+        row[:] = codes[i]
+        start_sq = move.start_row * 8 + move.start_col
+        row[move.end_row * 8 + move.end_col] = row[start_sq]
+        row[start_sq] = 0
+    white_to_move = np.arange(len(moves) + 1) % 2 == (0 if start.whiteToMove else 1)
+    return codes, white_to_move
+
+'''
+one-hot N x 12 x 8 x 8 planes, plane i is ChessEngine.PIECES[i] and is indexed [row][col] like GameState.board
+'''
+def piece_planes(codes, dtype=np.uint8):
+    planes = codes[:, None, :] == PIECE_CODES[None, :, None]
+    return planes.reshape(len(codes), 12, 8, 8).astype(dtype)
+
+'''
+N x 13 bitboards as uint64, column i holds the squares with piece code i (column 0 the empty squares)
+bit row * 8 + col is set for a square, like the GameState.bitboards
+'''
+def bitboards(codes):
+    planes = codes[:, None, :] == np.arange(13, dtype=np.int8)[None, :, None]
+    packed = np.packbits(planes, axis=2, bitorder="little")
+    return np.ascontiguousarray(packed).view("<u8").reshape(len(codes), 13)
+
+'''
+white material minus black material in centipawns
+'''
+def material(codes):
+    return MATERIAL_TABLE[codes].sum(axis=1)
+
+'''
+material and piece-square evaluation of every position from the point of view of the side to move,
+the same scores as ChessSearch.evaluate
+'''
+def evaluate_batch(codes, white_to_move):
+    scores = SQUARE_TABLE[codes, np.arange(64)].sum(axis=1)
+    return np.where(white_to_move, scores, -scores)
+
+def popcount(bb):
+    if hasattr(np, "bitwise_count"): #numpy 2
+        return np.bitwise_count(bb).astype(np.int32)
+    return _POPCOUNT_TABLE[bb.view(np.uint8).reshape(bb.shape + (8,))].sum(axis=-1, dtype=np.int32)
+
+def shift(bb, amount):
+    return bb << np.uint64(amount) if amount > 0 else bb >> np.uint64(-amount)
+
+'''
+the squares one (dr, dc) step away from the squares in bb
+'''
+def step(bb, dr, dc):
+    return shift(bb, dr * 8 + dc) & COLUMN_MASKS[dc]
+
+'''
+the squares slid to from the squares in bb in direction (dr, dc), up to and including the first occupied square,
+found with three doubling steps (Kogge-Stone fill) so every position moves at once
+'''
+def slide(bb, empty, dr, dc):
+    amount = dr * 8 + dc
+    empty = empty & COLUMN_MASKS[dc]
+    bb = bb | (empty & shift(bb, amount))
+    empty = empty & shift(empty, amount)
+    bb = bb | (empty & shift(bb, 2 * amount))
+    empty = empty & shift(empty, 2 * amount)
+    bb = bb | (empty & shift(bb, 4 * amount))
+    return step(bb, dr, dc)
+
+'''
+N x 12 mobility features, column i for ChessEngine.PIECES[i] (MOBILITY_FEATURES):
+the number of squares the pieces of that type can move to, each square counted once however many pieces reach it,
+pins and checks are ignored, pawns count their 1 and 2 square moves and captures
+'''
+def mobility(codes):
+    boards = bitboards(codes)
+    empty = boards[:, 0]
+    features = np.empty((len(codes), 12), dtype=np.int32)
+    for colour, sign in (("w", -1), ("b", 1)):
+        column = {piece[1]: boards[:, ChessEngine.PIECE_CODES[piece]] for piece in ChessEngine.PIECES if piece[0] == colour}
+        own = np.bitwise_or.reduce([column[kind] for kind in "PNBRQK"])
+        enemy = ~(own | empty)
+        pushes = step(column["P"], sign, 0) & empty
+        pushes |= step(pushes & SECOND_RANK[colour], sign, 0) & empty
+        captures = (step(column["P"], sign, -1) | step(column["P"], sign, 1)) & enemy
+        targets = {"P": pushes | captures}
+        targets["N"] = np.bitwise_or.reduce([step(column["N"], dr, dc) for dr, dc in ChessEngine.KNIGHT_OFFSETS])
+        targets["K"] = np.bitwise_or.reduce([step(column["K"], dr, dc) for dr, dc in
+                                             ChessEngine.ROOK_DIRECTIONS + ChessEngine.BISHOP_DIRECTIONS])
+        for kind, directions in (("R", ChessEngine.ROOK_DIRECTIONS), ("B", ChessEngine.BISHOP_DIRECTIONS),
+                                 ("Q", ChessEngine.ROOK_DIRECTIONS + ChessEngine.BISHOP_DIRECTIONS)):
+            targets[kind] = np.bitwise_or.reduce([slide(column[kind], empty, dr, dc) for dr, dc in directions])
+        offset = 0 if colour == "w" else 6
+        for i, kind in enumerate("PNBRQK"):
+            features[:, offset + i] = popcount(targets[kind] & ~own)
+    return features
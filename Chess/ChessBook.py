@@ -0,0 +1,194 @@
+"""
+responsible for building an opening book from PGN games and looking moves up in it,
+the book is a file of fixed size entries sorted by position key, laid out like a Polyglot book:
+key (8 bytes), move (2 bytes), weight (2 bytes), learn (4 bytes), big-endian.
+the key is GameState.zobrist_key and the move is Move.move_id, so the files are not readable by Polyglot tools.
+the file is memory-mapped and searched in place, opening it reads nothing and the pages are shared by every process.
+run from the project root with: python -m Chess.ChessBook build games.pgn --output book.bin
+"""
+import argparse
+import mmap
+import random
+import struct
+import sys
+import time
+
+from Chess import ChessEngine, ChessPgn
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+MAX_WEIGHT = 0xFFFF
+MAX_LEARN = 0xFFFFFFFF
+#points a game scores for the side that played the move, in half points so they stay integers
+RESULT_POINTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+class BookEntry():
+    def __init__(self, move_id, weight, learn):
+        self.move_id = move_id
+        self.weight = weight #games in which the move was played from this position
+        self.learn = learn #half points those games scored for the side that played it
+
+
+'''
+replays every game of the PGN files and counts the moves played from each position in the first max_plies plies
+returns {(key, move_id): [games, half points]}, games stop at their first illegal or unsupported move
+'''
+def collect_moves(paths, max_plies=20, counts=None):
+    counts = counts if counts is not None else {}
+    for path in paths:
+        for game in ChessPgn.read_pgn(path):
+            if game.headers.get("FEN"): #a book only makes sense from the start position
+                continue
+            points = RESULT_POINTS.get(game.result, (0, 0))
+            gs = ChessEngine.GameState()
+            for san in game.moves[:max_plies]:
+                try:
+                    move = ChessPgn.san_to_move(gs, san)
+                except ChessPgn.SanError:
+                    break
+                record = counts.setdefault((gs.zobrist_key, move.move_id), [0, 0])
+                record[0] += 1
+                record[1] += points[0] if gs.whiteToMove else points[1]
+                gs.make_move(move)
+    return counts
+
+'''
+writes the counted moves as a sorted book file, moves played in fewer than min_games games are left out
+returns the number of entries written
+'''
+def write_book(counts, output, min_games=1):
+    entries = sorted((key, move_id, min(games, MAX_WEIGHT), min(points, MAX_LEARN))
+                     for (key, move_id), (games, points) in counts.items() if games >= min_games)
+    data = bytearray(ENTRY.size * len(entries))
+    for i, entry in enumerate(entries):
+        ENTRY.pack_into(data, i * ENTRY.size, *entry)
+    with open(output, "wb") as book_file:
+        book_file.write(data)
+    return len(entries)
+
+'''
+builds a book file from PGN files, see collect_moves and write_book
+'''
+def build_book(paths, output, max_plies=20, min_games=1):
+    return write_book(collect_moves(paths, max_plies), output, min_games)
+
+
+class OpeningBook():
+    '''
+    a book file opened read-only through mmap, use it as a context manager or call close
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.book_file = open(path, "rb")
+        size = self.book_file.seek(0, 2)
+        if size % ENTRY.size:
+            self.book_file.close()
+            raise ValueError("%s is not a book file, its size is not a multiple of %d" % (path, ENTRY.size))
+        self.size = size // ENTRY.size #number of entries
+        #mmap cannot map an empty file, an empty book just has no moves
+        self.data = mmap.mmap(self.book_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.book_file.close()
+
+    '''
+    the index of the first entry whose key is not below key, by binary search over the mapped file
+    '''
+    def lower_bound(self, key):
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if KEY.unpack_from(self.data, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    '''
+    the BookEntry objects stored for a position key, most played first
+    '''
+    def entries(self, key):
+        found = []
+        i = self.lower_bound(key)
+        while i < self.size:
+            entry_key, move_id, weight, learn = ENTRY.unpack_from(self.data, i * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append(BookEntry(move_id, weight, learn))
+            i += 1
+        found.sort(key=lambda entry: entry.weight, reverse=True)
+        return found
+
+    '''
+    the book moves of the position as (move, weight), entries that are not legal here (key collisions) are skipped
+    '''
+    def moves(self, gs):
+        valid_moves = gs.get_valid_moves()
+        book_moves = []
+        for entry in self.entries(gs.zobrist_key):
+            move = valid_moves.get(entry.move_id)
+            if move is not None:
+                book_moves.append((move, entry.weight))
+        return book_moves
+
+    '''
+    a book move picked at random in proportion to how often it was played, or None when the position is not in the book
+    '''
+    def choose(self, gs, rng=random):
+        book_moves = self.moves(gs)
+        if not book_moves:
+            return None
+        pick = rng.randrange(sum(weight for move, weight in book_moves))
+        for move, weight in book_moves:
+            pick -= weight
+            if pick < 0:
+                return move
+        return book_moves[0][0]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build an opening book from PGN files or look a position up in one")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book file from PGN files")
+    build.add_argument("pgn", nargs="+", help="PGN files to read")
+    build.add_argument("--output", default="book.bin")
+    build.add_argument("--max-plies", type=int, default=20, help="plies of each game that go into the book")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book", help="book file")
+    probe.add_argument("--fen", default=ChessPgn.START_FEN)
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        entries = build_book(args.pgn, args.output, args.max_plies, args.min_games)
+        print("%d entries written to %s in %.2fs" % (entries, args.output, time.perf_counter() - start),
+              file=sys.stderr)
+        return 0
+    gs = ChessEngine.GameState()
+    try:
+        gs.load_fen(args.fen)
+    except ValueError as e:
+        probe.error(str(e))
+    with OpeningBook(args.book) as book:
+        book_moves = book.moves(gs)
+        total = sum(weight for move, weight in book_moves)
+        for move, weight in book_moves:
+            print("%-8s %6d %5.1f%%" % (ChessPgn.move_to_san(gs, move), weight, 100.0 * weight / total))
+    return 0 if book_moves else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,12 +4,109 @@ responsible for determining valid moves in the current state,
 responsible for keeping a move log.
 """
 from os import remove
+import random
+from array import array
+from collections import OrderedDict
+
+
+#piece names used for the bitboards, "--" is an empty square
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+#4-bit code of each piece for packing positions, 0 is an empty square
+PIECE_CODES = {"--": 0}
+PIECE_CODES.update({piece: i + 1 for i, piece in enumerate(PIECES)})
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+#rough piece values by piece code, for ordering captures most valuable victim first
+CAPTURE_VALUES = [0] + [{"P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}[piece[1]] for piece in PIECES]
+#colours index GameState.occupancy and PAWN_ATTACKS, the black piece codes are the white ones plus BLACK_OFFSET
+WHITE = 0
+BLACK = 1
+BLACK_OFFSET = 6
+KIND_CODES = {"P": 1, "N": 2, "B": 3, "R": 4, "Q": 5, "K": 6} #white piece code of each piece type
+CODE_KINDS = "-" + "PNBRQK" * 2 #piece type of each piece code
+CODE_COLOURS = [-1] + [WHITE] * 6 + [BLACK] * 6
+
+#squares are numbered row * 8 + col, so a8 is square 0 and h1 is square 63, bit n of a bitboard is square n
+FULL_BOARD = (1 << 64) - 1
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+
+'''
+bitboard of the squares one step away from each square for the given (row, col) offsets
+'''
+def _step_table(offsets):
+    table = []
+    for sq in range(64):
+        bb = 0
+        for d in offsets:
+            end_row = sq // 8 + d[0]
+            end_col = sq % 8 + d[1]
+            if 0 <= end_row < 8 and 0 <= end_col < 8:
+                bb |= 1 << (end_row * 8 + end_col)
+        table.append(bb)
+    return table
+
+'''
+bitboard of the squares from each square to the edge of the board in direction d
+'''
+def _ray_table(d):
+    table = []
+    for sq in range(64):
+        bb = 0
+        end_row = sq // 8 + d[0]
+        end_col = sq % 8 + d[1]
+        while 0 <= end_row < 8 and 0 <= end_col < 8:
+            bb |= 1 << (end_row * 8 + end_col)
+            end_row += d[0]
+            end_col += d[1]
+        table.append(bb)
+    return table
+
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+
+#attack tables, built once at import
+KNIGHT_ATTACKS = _step_table(KNIGHT_OFFSETS)
+KING_ATTACKS = _step_table(ROOK_DIRECTIONS + BISHOP_DIRECTIONS)
+PAWN_ATTACKS = [_step_table(((-1, -1), (-1, 1))), _step_table(((1, -1), (1, 1)))] #indexed by colour
+RAYS = {d: _ray_table(d) for d in ROOK_DIRECTIONS + BISHOP_DIRECTIONS}
+#zobrist keys for hashing positions, one random 64-bit number per piece per square and one for black to move
+#seeded so that the same position has the same key in every process and every run
+_zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for sq in range(64)] for piece in PIECES}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CODES = [[0] * 64] + [ZOBRIST_PIECES[piece] for piece in PIECES] #the keys by piece code
+#directions that go towards higher square numbers, where the nearest piece on a ray is the lowest set bit
+FORWARD_DIRECTIONS = {d for d in RAYS if d[0] * 8 + d[1] > 0}
+
+'''
+the nearest square to sq in direction d that is set in bb, or -1 if there is none
+'''
+def first_square(sq, d, bb):
+    bb &= RAYS[d][sq]
+    if not bb:
+        return -1
+    if d in FORWARD_DIRECTIONS:
+        return (bb & -bb).bit_length() - 1
+    return bb.bit_length() - 1
+
+'''
+yields the square numbers of the set bits of bb
+'''
+def squares_of(bb):
+    while bb:
+        bit = bb & -bb
+        yield bit.bit_length() - 1
+        bb ^= bit
 
 
 class GameState():
-    def __init__(self):
-        #the chess board with pieces as an 8*8 2d array
-        self.board = [
+    '''
+    starts from the initial position, or from board (an 8*8 2d array of piece names) with white to move
+    '''
+    def __init__(self, board=None):
+        #the chess board with pieces as an 8*8 2d array, only used to set up the bitboards
+        initial_board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bP", "bP", "bP", "bP", "bP", "bP", "bP", "bP"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -19,31 +116,196 @@ class GameState():
             ["wP", "wP", "wP", "wP", "wP", "wP", "wP", "wP"],
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
         ]
+        board = board if board is not None else initial_board
         self.move_functions = {'P': self.get_pawn_moves, 'R': self.get_rook_moves, 'N': self.get_knight_moves,
                                'B': self.get_bishop_moves, 'K': self.get_king_moves, 'Q': self.get_queen_moves}
         self.whiteToMove = True
         self.moveLog = []
+        #king squares as (row, col), set_board finds them
         self.white_king_location = (7, 4)
         self.black_king_location = (0, 4)
         self.in_check = False
         self.pins = []
         self.checks = []
+        #squares a piece may move to while generating moves, narrowed by get_valid_moves for checks and pins
+        self.check_mask = FULL_BOARD
+        self.pin_masks = {}
+        self.opponent_attacks = None #squares the opponent attacks, set by get_valid_moves for the king moves
+        self.move_cache = None #optional MoveCache of get_valid_moves results, see enable_move_cache
+        self.set_board(board)
+
+    '''
+    the position as an 8*8 2d array of piece names, derived from the square codes
+    '''
+    @property
+    def board(self):
+        squares = self.squares
+        return [squares[r * 8:r * 8 + 8] for r in range(8)]
+
+    '''
+    the piece name on each square, derived from the square codes
+    '''
+    @property
+    def squares(self):
+        return [CODE_PIECES[code] for code in self.square_codes]
+
+    @board.setter
+    def board(self, board):
+        self.set_board(board)
+
+    '''
+    rebuilds the square codes, bitboards, occupancy and king locations from an 8*8 2d array
+    '''
+    def set_board(self, board):
+        self.square_codes = [PIECE_CODES[board[r][c]] for r in range(8) for c in range(8)] #piece code on each square
+        self.bitboards = [0] * 13 #one bitboard per piece code, index 0 (empty squares) is not kept
+        self.occupancy = [0, 0] #all squares occupied by each colour
+        for sq, code in enumerate(self.square_codes):
+            if code:
+                self.bitboards[code] |= 1 << sq
+                self.occupancy[CODE_COLOURS[code]] |= 1 << sq
+                if code == KIND_CODES["K"]:
+                    self.white_king_location = (sq // 8, sq % 8)
+                elif code == KIND_CODES["K"] + BLACK_OFFSET:
+                    self.black_king_location = (sq // 8, sq % 8)
+        self.zobrist_key = self.compute_zobrist_key()
+
+    '''
+    hashes the whole position, make_move and undo_move keep self.zobrist_key up to date without calling this
+    the king squares are part of the key through the king piece keys
+    '''
+    def compute_zobrist_key(self):
+        key = 0 if self.whiteToMove else ZOBRIST_BLACK_TO_MOVE
+        for sq, code in enumerate(self.square_codes):
+            if code:
+                key ^= ZOBRIST_CODES[code][sq]
+        return key
+
+
+    '''
+    packs the position into 33 bytes: two squares per byte as 4-bit piece codes, then 1 if white is to move
+    the move log is not included, this is for sending positions between processes and storing them compactly
+    '''
+    def to_bytes(self):
+        codes = self.square_codes
+        packed = bytearray(33)
+        for i in range(32):
+            packed[i] = codes[2 * i] | codes[2 * i + 1] << 4
+        packed[32] = 1 if self.whiteToMove else 0
+        return bytes(packed)
+
+    '''
+    returns a new GameState set up from the output of to_bytes
+    '''
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) != 33:
+            raise ValueError("a packed position is 33 bytes, got %d" % len(data))
+        board = [["--"] * 8 for r in range(8)]
+        for i in range(32):
+            board[i // 4][i % 4 * 2] = CODE_PIECES[data[i] & 15]
+            board[i // 4][i % 4 * 2 + 1] = CODE_PIECES[data[i] >> 4]
+        gs = cls(board)
+        if data[32] != 1:
+            gs.whiteToMove = False
+            gs.zobrist_key ^= ZOBRIST_BLACK_TO_MOVE
+        return gs
+
+    '''
+    sets up the position from the piece placement and side to move fields of a FEN string
+    the castling and en-passant fields are ignored as the engine does not play those moves
+    raises ValueError for a position no game can reach: not exactly one king per side or the side not to move in check,
+    the position is left as it was then
+    '''
+    def load_fen(self, fen):
+        fields = fen.split()
+        if not fields:
+            raise ValueError("empty FEN")
+        rows = fields[0].split("/")
+        if len(rows) != 8:
+            raise ValueError("FEN must have 8 ranks: " + fen)
+        board = []
+        for rank in rows:
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char.upper() in "PNBRQK":
+                    row.append(("w" if char.isupper() else "b") + char.upper())
+                else:
+                    raise ValueError("invalid piece " + repr(char) + " in FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("FEN rank must have 8 squares: " + fen)
+            board.append(row)
+        if len(fields) > 1 and fields[1] not in ("w", "b"):
+            raise ValueError("FEN side to move must be w or b: " + fen)
+        for king in ("wK", "bK"):
+            if sum(row.count(king) for row in board) != 1:
+                raise ValueError("FEN must have exactly one " + ("white" if king == "wK" else "black") + " king: " + fen)
+        previous = (self.board, self.whiteToMove)
+        self.whiteToMove = len(fields) < 2 or fields[1] == "w"
+        self.set_board(board)
+        if self.opponent_in_check():
+            self.whiteToMove = previous[1]
+            self.set_board(previous[0])
+            raise ValueError("FEN side not to move is in check: " + fen)
+        self.moveLog = []
 
+    '''
+    True if the king of the side not to move is attacked, so it could be taken, which no legal game reaches
+    '''
+    def opponent_in_check(self):
+        mover, other_offset = (WHITE, BLACK_OFFSET) if self.whiteToMove else (BLACK, 0)
+        occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        return bool(self.attacked_squares(mover, occupied) & self.bitboards[KIND_CODES["K"] + other_offset])
+
+    '''
+    the position as a FEN string, castling and en-passant are always "-" as the engine does not play those moves
+    the move number counts from the position the game was set up in
+    '''
+    def get_fen(self):
+        rows = []
+        for r in range(8):
+            row = ""
+            empty = 0
+            for piece in self.squares[r * 8:r * 8 + 8]:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    row += str(empty)
+                    empty = 0
+                row += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                row += str(empty)
+            rows.append(row)
+        return "%s %s - - 0 %d" % ("/".join(rows), "w" if self.whiteToMove else "b", len(self.moveLog) // 2 + 1)
 
     '''
     takes a move as a parameter and executes it
     does not works for castling, en-passant and pawn promotion
+    the squares, masks and zobrist key change are worked out once per move object, see Move.set_derived
     '''
     def make_move(self, move):
-        self.board[move.start_row][move.start_col] = "--"
-        self.board[move.end_row][move.end_col] = move.piece_moved
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        bitboards[move.moved_code] ^= move.mask
+        occupancy[move.colour] ^= move.mask
+        if move.capture_bit:
+            bitboards[move.captured_code] ^= move.capture_bit
+            occupancy[move.captured_colour] ^= move.capture_bit
+        self.zobrist_key ^= move.key
+        codes = self.square_codes
+        codes[move.start] = 0
+        codes[move.end] = move.moved_code
         self.moveLog.append(move) #log the move into the moveLog
         self.whiteToMove = not self.whiteToMove #swap players turn
         #update king location
-        if move.piece_moved == "wK":
-            self.white_king_location = (move.end_row, move.end_col)
-        elif move.piece_moved == "bK":
-            self.black_king_location = (move.end_row, move.end_col)
+        if move.king_move:
+            if move.colour == WHITE:
+                self.white_king_location = (move.end_row, move.end_col)
+            else:
+                self.black_king_location = (move.end_row, move.end_col)
 
     '''
     undo the last move
@@ -51,20 +313,75 @@ class GameState():
     def undo_move(self):
         if len(self.moveLog) != 0: #check if there is a move to undo
             move = self.moveLog.pop()
-            self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            bitboards = self.bitboards
+            occupancy = self.occupancy
+            bitboards[move.moved_code] ^= move.mask
+            occupancy[move.colour] ^= move.mask
+            if move.capture_bit:
+                bitboards[move.captured_code] ^= move.capture_bit
+                occupancy[move.captured_colour] ^= move.capture_bit
+            self.zobrist_key ^= move.key
+            codes = self.square_codes
+            codes[move.start] = move.moved_code
+            codes[move.end] = move.captured_code
             self.whiteToMove = not self.whiteToMove # after undoing the move swap players turn
             # update king location
-            if move.piece_moved == "wK":
-                self.white_king_location = (move.start_row, move.start_col)
-            elif move.piece_moved == "bK":
-                self.black_king_location = (move.start_row, move.start_col)
+            if move.king_move:
+                if move.colour == WHITE:
+                    self.white_king_location = (move.start_row, move.start_col)
+                else:
+                    self.black_king_location = (move.start_row, move.start_col)
+
+    '''
+    caches get_valid_moves results in a bounded LRU cache keyed on the whole position, so positions that come back
+    after undo_move or by transposition are not generated again, pass a MoveCache to share one between GameStates
+    '''
+    def enable_move_cache(self, maxsize=4096, cache=None):
+        self.move_cache = cache if cache is not None else MoveCache(maxsize)
+        return self.move_cache
+
+    def disable_move_cache(self):
+        self.move_cache = None
+
+    '''
+    the full identity of the position: the piece on every square (so also both king squares) and the side to move
+    '''
+    def position_key(self):
+        return bytes(self.square_codes) + (b"w" if self.whiteToMove else b"b")
 
     ''''
     all moves considering checks
     '''
     def get_valid_moves(self):
-        moves = []
+        if self.move_cache is None:
+            return self.generate_valid_moves()
+        key = self.position_key()
+        entry = self.move_cache.get(key)
+        if entry is not None:
+            moves, self.in_check, self.pins, self.checks = entry
+            return moves.copy() #a copy so the caller can sort or remove moves without changing the cached list
+        moves = self.generate_valid_moves()
+        self.move_cache.put(key, (moves.copy(), self.in_check, self.pins, self.checks))
+        return moves
+
+    '''
+    generates all moves considering checks, without looking in the move cache
+    '''
+    def generate_valid_moves(self):
+        moves = MoveList()
+        king, double_check = self.set_move_masks()
+        if double_check: #double check king has to move
+            self.get_king_moves(king >> 3, king & 7, moves)
+        else: #the check and pin masks keep the moves of the other pieces legal
+            moves = self.get_possible_moves()
+        self.reset_move_masks()
+        return moves
+
+    '''
+    finds checks and pins and narrows the squares the pieces may move to: sets in_check, pins, checks,
+    opponent_attacks, pin_masks and check_mask, returns (king square, True if the king is in double check)
+    '''
+    def set_move_masks(self):
         self.in_check, self.pins, self.checks = self.check_for_pins_and_checks()
         if self.whiteToMove:
             king_row = self.white_king_location[0]
@@ -72,212 +389,248 @@ class GameState():
         else:
             king_row = self.black_king_location[0]
             king_col = self.black_king_location[1]
-        if self.in_check:
-            if len(self.checks) == 1: #checked by only 1 piece, block the check or move the king
-                moves = self.get_possible_moves()
-                # to block the check
-                check = self.checks[0] #check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col] #the opponents piece checking the king
-                valid_squares = [] #squares that piece can move
-                #if knight, must capture the knight or move king, other pieces can be blocked
-                if piece_checking[1] == 'N':
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i, king_col + check[3] * i) #check[2] & check[3] are check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[1] == check_col: #once u get the piece and the checks
-                            break
-                #get rid of any move that does not block the check or move the king
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].piece_moved[1] != 'K': #move does not move the king so it must block or capture the piece
-                        if not (moves[i].end_row, moves[i].end_col) in valid_squares: #move does not block the check or capture the piece
-                            moves.remove(moves[i])
-            else: #double check king has to move
-                self.get_king_moves(king_row, king_col, moves)
-        else: #not in check so all moves are valid
-            moves = self.get_possible_moves()
+        king = king_row * 8 + king_col
+        #the king is taken off the board so the squares behind it on a checking ray count as attacked
+        opponent_colour = BLACK if self.whiteToMove else WHITE
+        occupied = (self.occupancy[WHITE] | self.occupancy[BLACK]) ^ (1 << king)
+        self.opponent_attacks = self.attacked_squares(opponent_colour, occupied)
+        #a pinned piece may only move along the line through the king and the pinning piece
+        for pin in self.pins:
+            d = (pin[2], pin[3])
+            self.pin_masks[pin[0] * 8 + pin[1]] = RAYS[d][king] | RAYS[(-d[0], -d[1])][king]
+        if self.in_check and len(self.checks) == 1: #checked by only 1 piece, block the check or move the king
+            check = self.checks[0] #check information
+            check_square = check[0] * 8 + check[1]
+            d = (check[2], check[3]) #check[2] & check[3] are check directions
+            if d in RAYS: #squares between the king and the checking piece, including the piece itself
+                self.check_mask = RAYS[d][king] ^ RAYS[d][check_square]
+            else: #if knight, must capture the knight or move king
+                self.check_mask = 1 << check_square
+        return king, self.in_check and len(self.checks) > 1
 
-        return moves
+    def reset_move_masks(self):
+        self.check_mask = FULL_BOARD
+        self.pin_masks = {}
+        self.opponent_attacks = None
+
+    '''
+    the legal moves in stages for the search, each stage is only generated when the one before it has been used up:
+    the move with move_id hash_move_id if it is legal, then captures most valuable victim first (least valuable
+    attacker first among those), then quiet moves, sorted by quiet_key(move) highest first if it is given
+    with captures_only the quiet moves are left out unless the side to move is in check
+    checks and pins are worked out now, so in_check is set as soon as this returns, and the moves are generated
+    straight from the check and pin masks, there is no filtering of illegal moves
+    '''
+    def get_staged_moves(self, hash_move_id=0, quiet_key=None, captures_only=False):
+        king, double_check = self.set_move_masks()
+        masks = (self.check_mask, self.pin_masks, self.opponent_attacks)
+        self.reset_move_masks()
+        return self.generate_stages(king, double_check, masks, hash_move_id, quiet_key,
+                                    captures_only and not self.in_check)
+
+    def generate_stages(self, king, double_check, masks, hash_move_id, quiet_key, captures_only):
+        check_mask = masks[0]
+        own_colour = WHITE if self.whiteToMove else BLACK
+        own = self.occupancy[own_colour]
+        enemy = self.occupancy[own_colour ^ 1]
+        empty = FULL_BOARD ^ own ^ enemy
+        king_targets = KING_ATTACKS[king] & ~own & ~masks[2]
+
+        hash_code = -1
+        if hash_move_id:
+            start = hash_move_id // 1000 * 8 + hash_move_id // 100 % 10
+            end = hash_move_id // 10 % 10 * 8 + hash_move_id % 10
+            code = self.square_codes[start]
+            moves = MoveList()
+            if start == king:
+                self.add_moves(start, king_targets & (1 << end), moves)
+            elif CODE_COLOURS[code] == own_colour and not double_check: #only the moves of the one piece are generated
+                self.set_stage_masks(masks, check_mask & (1 << end))
+                self.move_functions[CODE_KINDS[code]](start >> 3, start & 7, moves)
+                self.reset_move_masks()
+            if moves:
+                hash_code = moves.codes[0]
+                yield Move.from_code(hash_code)
+
+        moves = MoveList()
+        if not double_check:
+            self.set_stage_masks(masks, check_mask & enemy)
+            self.get_piece_moves(moves)
+            self.reset_move_masks()
+        self.add_moves(king, king_targets & enemy, moves)
+        for code in sorted(moves.codes, key=lambda code: CAPTURE_VALUES[code >> 12 & 15] -
+                           CAPTURE_VALUES[code >> 16 & 15] * 16):
+            if code != hash_code:
+                yield Move.from_code(code)
+        if captures_only:
+            return
+
+        moves = MoveList()
+        if not double_check:
+            self.set_stage_masks(masks, check_mask & empty)
+            self.get_piece_moves(moves)
+            self.reset_move_masks()
+        self.add_moves(king, king_targets & empty, moves)
+        if quiet_key is not None:
+            moves.sort(key=quiet_key, reverse=True)
+        for code in moves.codes:
+            if code != hash_code:
+                yield Move.from_code(code)
+
+    '''
+    puts back the masks saved by get_staged_moves, with the check mask narrowed to the squares of the current stage
+    '''
+    def set_stage_masks(self, masks, check_mask):
+        self.check_mask = check_mask
+        self.pin_masks = masks[1]
+        self.opponent_attacks = masks[2]
+
+    '''
+    the moves of every piece except the king, the king moves of a stage are added from the saved attack map
+    '''
+    def get_piece_moves(self, moves):
+        offset = 0 if self.whiteToMove else BLACK_OFFSET
+        for piece, move_function in self.move_functions.items():
+            if piece != 'K':
+                for sq in squares_of(self.bitboards[KIND_CODES[piece] + offset]):
+                    move_function(sq >> 3, sq & 7, moves)
 
     '''
     all moves without considering checks
     '''
     def get_possible_moves(self):
-        moves = []
-        for r in range(len(self.board)):
-            for c in range(len(self.board[r])):
-                turn = self.board[r][c][0]
-                if (turn == 'w' and self.whiteToMove) or (turn == 'b' and not self.whiteToMove):
-                    piece = self.board[r][c][1]
-                    self.move_functions[piece](r, c, moves) #calls the appropriate move_function based on piece type
+        moves = MoveList()
+        offset = 0 if self.whiteToMove else BLACK_OFFSET
+        for piece, move_function in self.move_functions.items():
+            for sq in squares_of(self.bitboards[KIND_CODES[piece] + offset]):
+                move_function(sq >> 3, sq & 7, moves) #calls the appropriate move_function based on piece type
         return moves
 
+    '''
+    adds a move from the start square to each square in targets
+    '''
+    def add_moves(self, start, targets, moves):
+        codes = self.square_codes
+        start_code = start | codes[start] << 12
+        append = moves.codes.append
+        while targets:
+            bit = targets & -targets
+            end = bit.bit_length() - 1
+            append(start_code | end << 6 | codes[end] << 16)
+            targets ^= bit
+
     '''
     get all the pawn moves for pawn located in a row, col and add those moves to the list
     '''
     def get_pawn_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
+        sq = r * 8 + c
+        occupancy = self.occupancy
+        empty = FULL_BOARD ^ (occupancy[WHITE] | occupancy[BLACK])
         if self.whiteToMove: #white pawn moves
-            if self.board[r-1][c] == '--': #1 square pawn move
-                if not piece_pinned or pin_direction == (-1, 0):
-                    moves.append(Move((r, c), (r-1, c), self.board))
-                    if r == 6 and self.board[r-2][c] == '--': #2 square pawn move
-                        moves.append(Move((r, c), (r-2, c), self.board))
-            #captures
-            if c-1 >= 0: #captures to the left
-                if self.board[r-1][c-1][0] == 'b': #if there is an opponents piece to capture
-                    if not piece_pinned or pin_direction == (-1, -1):
-                        moves.append(Move((r, c), (r-1, c-1), self.board))
-            if c+1 <= 7: #captures to the right
-                if self.board[r-1][c+1][0] == 'b': #if there is an opponents piece to capture
-                    if not piece_pinned or pin_direction == (-1, 1):
-                        moves.append(Move((r, c), (r-1, c+1), self.board))
-
+            targets = (1 << sq >> 8) & empty #1 square pawn move
+            if r == 6:
+                targets |= (targets >> 8) & empty #2 square pawn move
+            targets |= PAWN_ATTACKS[WHITE][sq] & occupancy[BLACK] #captures
         else:  # Black pawn moves
-            if self.board[r + 1][c] == '--':  # 1 square pawn move
-                if not piece_pinned or pin_direction == (1, 0):
-                    moves.append(Move((r, c), (r + 1, c), self.board))
-                    if r == 1 and self.board[r + 2][c] == '--':  # 2 square pawn move
-                        moves.append(Move((r, c), (r + 2, c), self.board))
-            #captures
-            if c - 1 >= 0:  # Captures to the left
-                if self.board[r + 1][c - 1][0] == 'w':  # If there is an opponent's piece to capture
-                    if not piece_pinned or pin_direction == (1, -1):
-                        moves.append(Move((r, c), (r + 1, c - 1), self.board))
-            if c + 1 <= 7:  # Captures to the right
-                if self.board[r + 1][c + 1][0] == 'w':  # If there is an opponent's piece to capture
-                    if not piece_pinned or pin_direction == (1, 1):
-                        moves.append(Move((r, c), (r + 1, c + 1), self.board))
+            targets = (1 << sq << 8) & empty  # 1 square pawn move
+            if r == 1:
+                targets |= (targets << 8) & empty  # 2 square pawn move
+            targets |= PAWN_ATTACKS[BLACK][sq] & occupancy[WHITE] #captures
+        self.add_moves(sq, targets & self.check_mask & self.pin_masks.get(sq, FULL_BOARD), moves)
 
     '''
     get all the rook moves for pawn located in a row, col and add those moves to the list
     '''
     def get_rook_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[r][c][1] != 'Q': #can not remove queen from pin on rook moves, only remove it on bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1)) # up, down, left and right
-        opponent_colour = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < len(self.board) and 0 <= end_col < len(self.board[0]): #within the board
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--": #valid empty space
-                            moves.append(Move((r, c),(end_row, end_col), self.board))
-                        elif end_piece[0] == opponent_colour: #opponents piece valid
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else: #friendly piece invalid
-                            break
-                else: #off the board
-                    break
+        self.get_slider_moves(r, c, ROOK_DIRECTIONS, moves)
 
     '''
     get all the bishop moves for pawn located in a row, col and add those moves to the list
     '''
     def get_bishop_moves(self, r, c, moves):
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1)) #4 diagonals
-        opponent_colour = "b" if self.whiteToMove else "w"
+        self.get_slider_moves(r, c, BISHOP_DIRECTIONS, moves)
+
+    '''
+    get all the moves sliding from a row, col in the given directions up to the first piece
+    '''
+    def get_slider_moves(self, r, c, directions, moves):
+        sq = r * 8 + c
+        own = self.occupancy[WHITE if self.whiteToMove else BLACK]
+        occupied = self.occupancy[WHITE] | self.occupancy[BLACK]
+        targets = 0
         for d in directions:
-            for i in range(1, 8):
-                end_row = r + d[0] * i
-                end_col = c + d[1] * i
-                if 0 <= end_row < len(self.board) and 0 <= end_col < len(self.board[0]): #within the board
-                    if not piece_pinned or pin_direction == d or pin_direction == (-d[0], -d[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--": #valid empty space
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                        elif end_piece[0] == opponent_colour: #opponents piece valid
-                            moves.append(Move((r, c), (end_row, end_col), self.board))
-                            break
-                        else: #friendly piece invalid
-                            break
-                else: #off the board
-                    break
+            ray = RAYS[d]
+            attacks = ray[sq]
+            blockers = attacks & occupied
+            if blockers: #stop at the first piece on the ray, it can be captured if it is an opponents piece
+                if d in FORWARD_DIRECTIONS:
+                    attacks ^= ray[(blockers & -blockers).bit_length() - 1]
+                else:
+                    attacks ^= ray[blockers.bit_length() - 1]
+            targets |= attacks
+        self.add_moves(sq, targets & ~own & self.check_mask & self.pin_masks.get(sq, FULL_BOARD), moves)
 
     '''
     get all the knight moves for pawn located in a row, col and add those moves to the list
     '''
     def get_knight_moves(self, r, c, moves):
-        piece_pinned = False
-        for i in range(len(self.pins)-1, -1, -1):
-            if self.pins[i][0] == r and self.pins[i][1] == c:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-        knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        allay_colour = "w" if self.whiteToMove else "b"
-        for m in knight_moves:
-            end_row = r + m[0]
-            end_col = c + m[1]
-            if 0 <= end_row < len(self.board) and 0 <= end_col < len(self.board[0]):
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != allay_colour:  # not an allay piece (an opponents piece or empty)
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
+        sq = r * 8 + c
+        if sq in self.pin_masks: #a pinned knight can never move
+            return
+        own = self.occupancy[WHITE if self.whiteToMove else BLACK]
+        self.add_moves(sq, KNIGHT_ATTACKS[sq] & ~own & self.check_mask, moves)
 
     '''
     get all the king moves for pawn located in a row, col and add those moves to the list
     '''
     def get_king_moves(self, r, c, moves):
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
-        allay_colour = "w" if self.whiteToMove else "b"
-        for i in range(8):
-            end_row = r + row_moves[i]
-            end_col = c + col_moves[i]
-            if 0 <= end_row < len(self.board) and 0 <= end_col < len(self.board[0]):
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != allay_colour:
-                    #place king on the square and check for checks
-                    if allay_colour == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.check_for_pins_and_checks()
-                    if not in_check:
-                        moves.append(Move((r, c), (end_row, end_col), self.board))
-                    #place king back on original location
-                    if allay_colour == "w":
-                        self.white_king_location = (r, c)
-                    else:
-                        self.black_king_location = (r, c)
+        allay_colour = WHITE if self.whiteToMove else BLACK
+        start = r * 8 + c
+        attacked = self.opponent_attacks
+        if attacked is None: #called outside get_valid_moves
+            occupied = (self.occupancy[WHITE] | self.occupancy[BLACK]) ^ (1 << start)
+            attacked = self.attacked_squares(allay_colour ^ 1, occupied)
+        #the king can go to any square that is not an allied piece and not attacked
+        self.add_moves(start, KING_ATTACKS[start] & ~self.occupancy[allay_colour] & ~attacked, moves)
 
     '''
     get all the queen moves for pawn located in a row, col and add those moves to the list
     '''
     def get_queen_moves(self, r, c, moves):
         #essentially queen move is a combination of rook moves and bishop moves
-        self.get_rook_moves(r, c, moves)
-        self.get_bishop_moves(r, c, moves)
+        self.get_slider_moves(r, c, ROOK_DIRECTIONS + BISHOP_DIRECTIONS, moves)
+
+    '''
+    all squares attacked by the pieces of the given colour (WHITE or BLACK) when the squares in occupied block
+    the sliding pieces
+    '''
+    def attacked_squares(self, colour, occupied):
+        bitboards = self.bitboards
+        offset = BLACK_OFFSET if colour == BLACK else 0
+        pawns = bitboards[1 + offset]
+        if colour == WHITE:
+            attacks = ((pawns & ~FILE_A) >> 9) | ((pawns & ~FILE_H) >> 7)
+        else:
+            attacks = (((pawns & ~FILE_A) << 7) | ((pawns & ~FILE_H) << 9)) & FULL_BOARD
+        for sq in squares_of(bitboards[2 + offset]):
+            attacks |= KNIGHT_ATTACKS[sq]
+        for sq in squares_of(bitboards[6 + offset]):
+            attacks |= KING_ATTACKS[sq]
+        queens = bitboards[5 + offset]
+        for directions, sliders in ((ROOK_DIRECTIONS, queens | bitboards[4 + offset]),
+                                    (BISHOP_DIRECTIONS, queens | bitboards[3 + offset])):
+            for sq in squares_of(sliders):
+                for d in directions:
+                    ray = RAYS[d]
+                    ray_attacks = ray[sq]
+                    blockers = ray_attacks & occupied
+                    if blockers:
+                        if d in FORWARD_DIRECTIONS:
+                            ray_attacks ^= ray[(blockers & -blockers).bit_length() - 1]
+                        else:
+                            ray_attacks ^= ray[blockers.bit_length() - 1]
+                    attacks |= ray_attacks
+        return attacks
 
     '''
     returns a list of pins and checks if there are any
@@ -287,68 +640,54 @@ class GameState():
         checks = [] #the squares where the opponent is when checking
         in_check = False
         if self.whiteToMove:
-            opponent_colour = "b"
-            allay_colour = "w"
+            opponent_colour = BLACK
+            allay_colour = WHITE
             start_row = self.white_king_location[0]
             start_col = self.white_king_location[1]
         else:
-            opponent_colour = "w"
-            allay_colour = "b"
+            opponent_colour = WHITE
+            allay_colour = BLACK
             start_row = self.black_king_location[0]
             start_col = self.black_king_location[1]
+        king = start_row * 8 + start_col
+        bitboards = self.bitboards
+        offset = BLACK_OFFSET if opponent_colour == BLACK else 0 #of the opponent's piece codes
+        #the allied king is looked through, so a king stepping back along a checking ray is still in check
+        occupied = (self.occupancy[WHITE] | self.occupancy[BLACK]) & ~(1 << king)
+        opponents = self.occupancy[opponent_colour]
+        queens = bitboards[5 + offset]
         # check outward from the king for pins and checks
-        directions = ((-1, 0), (0, -1), (1, -0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            d = directions[j]
-            possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + d[0] * i
-                end_col = start_col + d[1] * i
-                if 0 <= end_row < len(self.board) and 0 <= end_col < len(self.board[0]):
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == allay_colour and end_piece[1] != 'K':
-                        if possible_pin == ():  # ist allied piece could be pined
-                            possible_pin = (end_row, end_col, d[0], d[1])
-                        else:  # 2nd allied piece so no check or pin possible on this side
-                            break
-                    elif end_piece[0] == opponent_colour:
-                        type = end_piece[1]
-                        # 5 possibilities here in this conditional
-                        # 1) orthogonally away from the king, checked by a Rook
-                        # 2) diagonally away from the king, checked by a bishop
-                        # 3) 1 square diagonally away from the king, checked by a pawn
-                        # 4) any direction, checked by a Queen
-                        # 5) any direction 1 square away (this is for preventing the king moving to a square controlled by the opposite colour king)
-                        if (0 <= j <= 3 and type == 'R') or \
-                                (4 <= j <= 7 and type == 'B') or \
-                                (i == 1 and type == 'P' and ((opponent_colour == 'w' and 6 <= j <= 7) or (
-                                        opponent_colour == 'b' and 4 <= j <= 5))) or \
-                                (type == 'Q') or (i == 1 and type == 'K'):
-                            if possible_pin == ():  # no other piece blocking
-                                in_check = True
-                                checks.append((end_row, end_col, d[0], d[1]))
-                                break
-                            else:  # a piece blocking so pinned
-                                pins.append(possible_pin)
-                                break
-                        else:  # opponent piece not applying checks
-                            break
-                else:
-                    break  # off board
-        # knight checks
-        knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
-        for m in knight_moves:
-            end_row = start_row + m[0]
-            end_col = start_col + m[1]
-            if 0 <= end_row < len(self.board) and 0 <= end_col < len(self.board[0]):
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == opponent_colour and end_piece[1] == 'N':
-                    in_check = True
-                    checks.append((end_row, end_col, m[0], m[1]))
+        for directions, sliders in ((ROOK_DIRECTIONS, queens | bitboards[4 + offset]),
+                                    (BISHOP_DIRECTIONS, queens | bitboards[3 + offset])):
+            for d in directions:
+                if not RAYS[d][king] & sliders: #no rook, bishop or queen on this side
+                    continue
+                blocker = first_square(king, d, occupied)
+                if (1 << blocker) & opponents:
+                    if (1 << blocker) & sliders:
+                        in_check = True
+                        checks.append((blocker >> 3, blocker & 7, d[0], d[1]))
+                else: # 1st allied piece could be pinned
+                    pinner = first_square(blocker, d, occupied)
+                    if pinner >= 0 and (1 << pinner) & sliders: # the next piece behind it pins it
+                        pins.append((blocker >> 3, blocker & 7, d[0], d[1]))
+        # pawn, knight and king checks (a king 1 square away stops the king moving next to it)
+        attackers = (PAWN_ATTACKS[allay_colour][king] & bitboards[1 + offset]) | \
+                    (KNIGHT_ATTACKS[king] & bitboards[2 + offset]) | \
+                    (KING_ATTACKS[king] & bitboards[6 + offset])
+        for sq in squares_of(attackers):
+            in_check = True
+            checks.append((sq >> 3, sq & 7, (sq >> 3) - start_row, (sq & 7) - start_col))
         return in_check, pins, checks
 
 
 class Move():
+    #moves are immutable and shared: the generators make each distinct move object once and reuse it from _interned
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured", "move_id", "code",
+                 "start", "end", "moved_code", "captured_code", "mask", "capture_bit", "colour", "captured_colour", "key",
+                 "king_move")
+    _interned = {}
+
     #turn rows and columns into ranks and files to make chess notation
     #maps keys to values
     #keys : values
@@ -365,6 +704,56 @@ class Move():
         self.piece_moved = board[self.start_row][self.start_col]
         self.piece_captured = board[self.end_row][self.end_col]
         self.move_id = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col #gives a unique id to each move
+        #start square, end square, moved piece and captured piece packed into 20 bits
+        self.code = (self.start_row * 8 + self.start_col) | (self.end_row * 8 + self.end_col) << 6 | \
+                    PIECE_CODES[self.piece_moved] << 12 | PIECE_CODES[self.piece_captured] << 16
+        self.set_derived()
+
+    '''
+    sets what make_move and undo_move need so they do no lookups: the square numbers, the piece codes, the bits
+    that change for the moved and the captured piece, their colours and the zobrist key change including the side to move
+    '''
+    def set_derived(self):
+        self.start = self.start_row * 8 + self.start_col
+        self.end = self.end_row * 8 + self.end_col
+        self.moved_code = PIECE_CODES[self.piece_moved]
+        self.captured_code = PIECE_CODES[self.piece_captured]
+        self.mask = (1 << self.start) | (1 << self.end)
+        self.colour = CODE_COLOURS[self.moved_code]
+        self.king_move = CODE_KINDS[self.moved_code] == "K"
+        self.key = ZOBRIST_BLACK_TO_MOVE ^ ZOBRIST_CODES[self.moved_code][self.start] ^ \
+            ZOBRIST_CODES[self.moved_code][self.end] ^ ZOBRIST_CODES[self.captured_code][self.end]
+        self.capture_bit = 1 << self.end if self.captured_code else 0
+        self.captured_colour = CODE_COLOURS[self.captured_code]
+
+    '''
+    returns the shared move for a code: start square | end square << 6 | moved piece code << 12 | captured piece code << 16
+    '''
+    @classmethod
+    def from_code(cls, code):
+        move = cls._interned.get(code)
+        if move is None:
+            move = cls.__new__(cls)
+            start = code & 63
+            end = code >> 6 & 63
+            move.start_row = start >> 3
+            move.start_col = start & 7
+            move.end_row = end >> 3
+            move.end_col = end & 7
+            move.piece_moved = CODE_PIECES[code >> 12 & 15]
+            move.piece_captured = CODE_PIECES[code >> 16 & 15]
+            move.move_id = MOVE_IDS[code & 4095]
+            move.code = code
+            move.set_derived()
+            cls._interned[code] = move
+        return move
+
+    '''
+    returns the shared move from square numbers (row * 8 + col) and the pieces on them, without needing a 2d board
+    '''
+    @classmethod
+    def from_squares(cls, start, end, piece_moved, piece_captured):
+        return cls.from_code(start | end << 6 | PIECE_CODES[piece_moved] << 12 | PIECE_CODES[piece_captured] << 16)
 
     '''
     overriding equals method
@@ -374,10 +763,126 @@ class Move():
             return self.move_id == other.move_id
         return False
 
+    def __hash__(self):
+        return self.move_id
+
 
     def get_chess_notation(self):
         #can add to make this like real chess notation
         return self.get_rank_file(self.start_row, self.start_col) + self.get_rank_file(self.end_row, self.end_col)
 
     def get_rank_file(self, r, c):
-        return self.cols_to_files[c], self.rows_to_ranks[r]
\ No newline at end of file
+        return self.cols_to_files[c] + self.rows_to_ranks[r]
+
+
+#Move.move_id for each start square | end square << 6
+MOVE_IDS = [(start >> 3) * 1000 + (start & 7) * 100 + (end >> 3) * 10 + (end & 7)
+            for end in range(64) for start in range(64)]
+
+
+class MoveList():
+    '''
+    a list of moves stored as an array of move codes, iterating and indexing give the shared Move objects
+    membership is checked by move_id in constant time
+    '''
+    __slots__ = ("codes", "_by_id")
+
+    def __init__(self, moves=()):
+        self.codes = array('I')
+        self._by_id = None #move_id -> code, built on the first lookup
+        for move in moves:
+            self.append(move)
+
+    def append(self, move):
+        self.codes.append(move.code)
+        self._by_id = None
+
+    def append_code(self, code):
+        self.codes.append(code)
+        self._by_id = None
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __bool__(self):
+        return len(self.codes) > 0
+
+    def __iter__(self):
+        return map(Move.from_code, self.codes)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [Move.from_code(code) for code in self.codes[i]]
+        return Move.from_code(self.codes[i])
+
+    def __contains__(self, move):
+        return isinstance(move, Move) and self.get(move.move_id) is not None
+
+    def __repr__(self):
+        return "MoveList([" + ", ".join(move.get_chess_notation() for move in self) + "])"
+
+    '''
+    the move with the given move_id, or None if it is not in the list
+    '''
+    def get(self, move_id):
+        if self._by_id is None:
+            self._by_id = {MOVE_IDS[code & 4095]: code for code in self.codes}
+        code = self._by_id.get(move_id)
+        return Move.from_code(code) if code is not None else None
+
+    def remove(self, move):
+        for i, code in enumerate(self.codes):
+            if MOVE_IDS[code & 4095] == move.move_id:
+                del self.codes[i]
+                self._by_id = None
+                return
+        raise ValueError("move not in list")
+
+    def sort(self, key=None, reverse=False):
+        moves = sorted(self, key=key, reverse=reverse)
+        self.codes = array('I', [move.code for move in moves])
+
+    def copy(self):
+        moves = MoveList()
+        moves.codes = array('I', self.codes)
+        return moves
+
+
+class MoveCache():
+    '''
+    a bounded least recently used cache from GameState.position_key to the results of get_valid_moves
+    '''
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
@@ -1,23 +1,51 @@
 """
 main driver file
 responsible for handling user inputs and displaying the current GameState objects.
+the window is only repainted when something changes: the loop sleeps on p.event.wait and a move or an undo
+repaints just the squares it touched from a pre-rendered board surface.
+pressing 'e' hands the side to move to the engine (or takes it back), which thinks in a ChessWorker process.
+pressing 'p' starts or stops profiling the move generator, the stats are shown over the board while it runs
+and written to PROFILE_PATH when it stops.
 """
+import os
+
 import pygame as p
-from Chess import ChessEngine
+from Chess import ChessEngine, ChessProfiler, ChessWorker
 
 WIDTH = HEIGHT = 512
 DIMENSION = 8
 SQ_SIZE = HEIGHT // DIMENSION
-MAX_FPS = 15
 IMAGES = {}
+IMAGE_DIR = "images/"
+SPRITE_CACHE_DIR = os.path.join(IMAGE_DIR, "cache") #scaled sprites, one folder per SQ_SIZE
+#only these events wake the loop up, mouse motion and the rest are dropped before they reach the queue
+HANDLED_EVENTS = [p.QUIT, p.MOUSEBUTTONDOWN, p.KEYDOWN, p.VIDEOEXPOSE, p.WINDOWEXPOSED]
+ENGINE_TIME = 1.0 #seconds the engine thinks about a move
+ENGINE_POLL_MS = 1000 // 30 #while the engine thinks the loop also wakes up this often to look for its move
+BOOK_PATH = "book.bin" #opening book used by the engine when the file exists, see ChessBook
+PROFILE_PATH = "movegen_profile.json"
 
 '''
 Initiate the images
+the sprites scaled to SQ_SIZE are saved under SPRITE_CACHE_DIR and loaded from there on the next launch
 '''
 def load_images():
     pieces = ['wR', 'wN', 'wB', 'wQ', 'wK', 'wP', 'bR', 'bN', 'bB', 'bQ', 'bK', 'bP']
+    cache_dir = os.path.join(SPRITE_CACHE_DIR, str(SQ_SIZE))
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQ_SIZE, SQ_SIZE))
+        cached = os.path.join(cache_dir, piece + ".png")
+        source = IMAGE_DIR + piece + ".png"
+        if os.path.exists(cached) and os.path.getmtime(cached) >= os.path.getmtime(source):
+            image = p.image.load(cached)
+        else:
+            image = p.transform.scale(p.image.load(source), (SQ_SIZE, SQ_SIZE))
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                p.image.save(image, cached)
+            except (OSError, p.error): #a read-only install still runs, it just scales again next time
+                pass
+        #converted to the display's pixel format once so blits do not convert on every repaint
+        IMAGES[piece] = image.convert_alpha() if p.display.get_surface() is not None else image
 
 '''
 the main function
@@ -26,22 +54,33 @@ responsible for handling user inputs and graphics
 def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))
-    clock = p.time.Clock()
-    screen.fill(p.Color("white"))
+    p.event.set_blocked(None)
+    p.event.set_allowed(HANDLED_EVENTS)
     gs = ChessEngine.GameState()
+    gs.enable_move_cache() #undoing with 'z' goes back to positions whose moves are already cached
     valid_moves = gs.get_valid_moves()
     move_made = False #flag variable for when the move made
     load_images() # executed once before the while loop
+    board_surface = render_board() # the empty board is drawn once and copied from then on
+    draw_game_state(screen, gs, board_surface)
+    p.display.flip()
     running = True
     sq_selected = () #if no square is selected, keep track of the last click of the user
     player_clicks = [] #keep track of player clicks
+    engine_sides = set() #colours played by the engine
+    worker = None #started the first time the engine is asked to play
+    profiler = None #a ChessProfiler.MoveGenProfiler while 'p' has switched profiling on
 
     while running:
-        for e in p.event.get():
+        dirty = set() #(row, col) of the squares to repaint
+        full_redraw = False
+        engine_thinking = worker is not None and worker.busy and not worker.pondering
+        #sleeps until there is an event, then handles everything that queued up meanwhile
+        for e in [p.event.wait(ENGINE_POLL_MS if engine_thinking else 0)] + p.event.get():
             if e.type == p.QUIT:
                 running = False
-            #mouse handler
-            elif e.type == p.MOUSEBUTTONDOWN:
+            #mouse handler, clicks are ignored while it is the engine's turn
+            elif e.type == p.MOUSEBUTTONDOWN and side_to_move(gs) not in engine_sides:
                 location = p.mouse.get_pos() #location of the mouse as x & y
                 col = location[0] // SQ_SIZE
                 row = location[1] // SQ_SIZE
@@ -54,8 +93,10 @@ def main():
                 if len(player_clicks) == 2: #after 2nd click
                     move = ChessEngine.Move(player_clicks[0], player_clicks[1], gs.board)
                     print(move.get_chess_notation())
-                    if move in valid_moves:
-                        gs.make_move(move)
+                    valid_move = valid_moves.get(move.move_id) #constant time lookup of the engine's move
+                    if valid_move is not None:
+                        gs.make_move(valid_move)
+                        dirty.update(move_squares(valid_move))
                         move_made = True
                         sq_selected = () #after making the move resets the user clicks
                         player_clicks = []
@@ -64,24 +105,116 @@ def main():
             #key handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: #undo when 'z' is pressed
-                    gs.undo_move()
-                    move_made = True
+                    #against the engine its reply is taken back too, so it is the player's turn again
+                    for ply in range(2):
+                        if not gs.moveLog:
+                            break
+                        dirty.update(move_squares(gs.moveLog[-1]))
+                        gs.undo_move()
+                        move_made = True
+                        if side_to_move(gs) not in engine_sides or len(engine_sides) == 2:
+                            break
+                elif e.key == p.K_e: #the engine plays the side to move, or stops playing it
+                    engine_sides ^= {side_to_move(gs)}
+                    if worker is None:
+                        worker = ChessWorker.EngineWorker(book_path=BOOK_PATH if os.path.exists(BOOK_PATH) else None)
+                    start_engine(worker, gs, valid_moves, engine_sides)
+                elif e.key == p.K_p: #profile the move generator, or stop and save the stats
+                    if profiler is None:
+                        profiler = ChessProfiler.MoveGenProfiler()
+                        profiler.attach(gs)
+                    else:
+                        profiler.detach(gs)
+                        profiler.dump_json(PROFILE_PATH)
+                        profiler = None
+                    full_redraw = True
+            #the window was uncovered or restored and its contents may be gone
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):
+                full_redraw = True
+
+        if engine_thinking and worker.busy and not move_made:
+            response = worker.poll()
+            if response is not None and response.result[1]:
+                engine_move = valid_moves.get(response.result[1][0]) #the first move of the principal variation
+                gs.make_move(engine_move)
+                dirty.update(move_squares(engine_move))
+                move_made = True
 
         if move_made:
             valid_moves = gs.get_valid_moves()
             move_made = False
+            if worker is not None: #the position the engine was thinking about is gone
+                start_engine(worker, gs, valid_moves, engine_sides)
+
+        if not running:
+            if worker is not None:
+                worker.close()
+            break
+        if full_redraw or (dirty and profiler is not None): #the overlay covers the board, so it is all redrawn
+            draw_game_state(screen, gs, board_surface)
+            if profiler is not None:
+                draw_profile_overlay(screen, profiler)
+            p.display.flip()
+        elif dirty:
+            p.display.update(draw_squares(screen, gs.board, board_surface, dirty))
+
+'''
+"w" or "b"
+'''
+def side_to_move(gs):
+    return "w" if gs.whiteToMove else "b"
+
+'''
+gives the worker its next job after the position changed: find a move if the engine is to move,
+ponder if the engine plays the other side, otherwise stop thinking
+'''
+def start_engine(worker, gs, valid_moves, engine_sides):
+    if valid_moves and side_to_move(gs) in engine_sides:
+        worker.search(gs, time_limit=ENGINE_TIME)
+    elif valid_moves and engine_sides:
+        worker.ponder(gs)
+    else:
+        worker.cancel()
 
-        draw_game_state(screen, gs)
-        clock.tick(MAX_FPS)
-        p.display.flip()
+'''
+the squares a move changes on the board, the same ones change back when it is undone
+'''
+def move_squares(move):
+    return ((move.start_row, move.start_col), (move.end_row, move.end_col))
 
 '''
 responsible for all the graphics on the current gameState
 '''
-def draw_game_state(screen, gs):
-    draw_board(screen)
+def draw_game_state(screen, gs, board_surface=None):
+    if board_surface is None:
+        draw_board(screen)
+    else:
+        screen.blit(board_surface, (0, 0))
     draw_pieces(screen, gs.board)
 
+'''
+the empty board drawn once onto its own surface so repaints copy it instead of drawing the squares again
+'''
+def render_board():
+    board_surface = p.Surface((WIDTH, HEIGHT))
+    draw_board(board_surface)
+    return board_surface.convert() if p.display.get_surface() is not None else board_surface
+
+'''
+repaints only the given (row, col) squares: the background from board_surface, then the piece on it
+returns the rectangles that changed, for p.display.update
+'''
+def draw_squares(screen, board, board_surface, squares):
+    rects = []
+    for r, c in squares:
+        rect = p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)
+        screen.blit(board_surface, rect, rect)
+        piece = board[r][c]
+        if piece != "--":
+            screen.blit(IMAGES[piece], rect)
+        rects.append(rect)
+    return rects
+
 '''
 order of drawing 01
 responsible for drawing the squares in the board
@@ -104,5 +237,18 @@ def draw_pieces(screen, board):
             if piece != "--": #if the square is not empty
                 screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
 
+'''
+order of drawing 03, only while profiling
+responsible for drawing the profiler stats over the top of the board
+'''
+def draw_profile_overlay(screen, profiler):
+    font = p.font.SysFont("monospace", 13) #a fixed width font keeps the columns lined up
+    lines = profiler.report_lines()
+    overlay = p.Surface((WIDTH, 14 * len(lines) + 6), p.SRCALPHA)
+    overlay.fill((0, 0, 0, 170))
+    for i, line in enumerate(lines):
+        overlay.blit(font.render(line, True, p.Color("white")), (4, 3 + 14 * i))
+    screen.blit(overlay, (0, 0))
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
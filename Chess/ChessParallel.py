@@ -0,0 +1,183 @@
+"""
+responsible for running perft and the best move search on several cores with a process pool,
+the root moves are split between worker processes, positions are sent as GameState.to_bytes and moves as Move.move_id.
+run from the project root with: python -m Chess.ChessParallel --depth 5 --workers 8
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import ChessEngine, ChessPerft, ChessSearch
+
+#the searcher of a worker process, kept between tasks so its transposition table is reused
+_worker_searcher = None
+
+
+def _perft_task(packed, depth):
+    return ChessPerft.perft(ChessEngine.GameState.from_bytes(packed), depth)
+
+def _search_task(packed, move_ids, max_depth, deadline, node_limit, tt_size_mb):
+    global _worker_searcher
+    if _worker_searcher is None:
+        _worker_searcher = ChessSearch.Searcher(tt_size_mb)
+    gs = ChessEngine.GameState.from_bytes(packed)
+    time_limit = max(0.0, deadline - time.time()) if deadline is not None else None
+    result = _worker_searcher.search(gs, max_depth, time_limit, node_limit, root_move_ids=move_ids)
+    iterations = [(depth, score, [move.move_id for move in pv]) for depth, score, pv in result.iterations]
+    return iterations, result.nodes
+
+'''
+finds the move with the given move_id among the legal moves of the position
+'''
+def find_move(gs, move_id):
+    for move in gs.get_valid_moves():
+        if move.move_id == move_id:
+            return move
+    raise ValueError("move %d is not legal in this position" % move_id)
+
+'''
+the positions split_depth plies below gs as (list of root move ids, packed position), so there are enough tasks for every core
+'''
+def split_positions(gs, split_depth):
+    if split_depth == 0:
+        return [([], gs.to_bytes())]
+    positions = []
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        for path, packed in split_positions(gs, split_depth - 1):
+            positions.append(([move.move_id] + path, packed))
+        gs.undo_move()
+    return positions
+
+
+class ParallelEngine():
+    '''
+    holds the process pool so it is started only once, use it as a context manager or call close
+    '''
+    def __init__(self, workers=None, tt_size_mb=16):
+        self.workers = workers or os.cpu_count() or 1
+        self.tt_size_mb = tt_size_mb
+        self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    '''
+    perft split by root move, returns a list of (move, nodes) like ChessPerft.divide
+    the tree is split 2 plies deep for depths above 3 so the work spreads over many more tasks than there are root moves
+    '''
+    def divide(self, gs, depth):
+        if depth < 1:
+            return []
+        split_depth = 2 if depth > 3 else 1
+        positions = split_positions(gs, min(split_depth, depth))
+        futures = [self.executor.submit(_perft_task, packed, depth - len(path)) for path, packed in positions]
+        counts = {}
+        for (path, packed), future in zip(positions, futures):
+            counts[path[0]] = counts.get(path[0], 0) + future.result()
+        return [(move, counts.get(move.move_id, 0)) for move in gs.get_valid_moves()]
+
+    def perft(self, gs, depth):
+        if depth == 0:
+            return 1
+        return sum(nodes for move, nodes in self.divide(gs, depth))
+
+    '''
+    searches each share of the root moves in its own process and returns the best as a ChessSearch.SearchResult
+    workers do not share bounds, so the speedup comes from searching root moves side by side rather than from a deeper tree
+    with a time or node limit the shares reach different depths, and scores from different depths are not comparable,
+    so the shares are compared at the deepest depth they all completed, see best_iteration
+    '''
+    def search(self, gs, max_depth=ChessSearch.MAX_PLY, time_limit=None, node_limit=None):
+        start = time.perf_counter()
+        root_moves = gs.get_valid_moves()
+        if not root_moves:
+            score = -ChessSearch.MATE_SCORE if gs.in_check else 0
+            return ChessSearch.SearchResult(None, score, [], 0, 0, time.perf_counter() - start)
+        deadline = time.time() + time_limit if time_limit is not None else None
+        shares = [[] for i in range(min(self.workers, len(root_moves)))]
+        for i, move in enumerate(root_moves):
+            shares[i % len(shares)].append(move.move_id)
+        per_share_nodes = node_limit // len(shares) if node_limit is not None else None
+        packed = gs.to_bytes()
+        futures = [self.executor.submit(_search_task, packed, share, max_depth, deadline, per_share_nodes, self.tt_size_mb)
+                   for share in shares]
+        results = [future.result() for future in futures]
+        nodes = sum(result[1] for result in results)
+        best = best_iteration([result[0] for result in results])
+        if best is None: #no share finished depth 1
+            move = ChessSearch.static_best_move(gs, root_moves)
+            return ChessSearch.SearchResult(move, 0, [move], nodes, 0, time.perf_counter() - start)
+        depth, score, pv_ids = best
+        pv = []
+        for move_id in pv_ids:
+            move = find_move(gs, move_id)
+            pv.append(move)
+            gs.make_move(move)
+        for move in pv:
+            gs.undo_move()
+        best_move = pv[0] if pv else ChessSearch.static_best_move(gs, root_moves) #pv lost from the table
+        return ChessSearch.SearchResult(best_move, score, pv or [best_move], nodes, depth, time.perf_counter() - start)
+
+
+'''
+the (depth, score, pv move ids) to play from the completed iterations of every share, None if no share completed one:
+a share that found a forced mate wins outright (the shortest mate), otherwise the best score at the deepest depth
+every share completed, leaving out shares that completed nothing and shares whose every move is mated,
+which stop early and are only played when all shares are mated (the longest mate)
+'''
+def best_iteration(share_iterations):
+    finished = [iterations for iterations in share_iterations if iterations]
+    if not finished:
+        return None
+    last = [iterations[-1] for iterations in finished]
+    mates = [iteration for iteration in last if iteration[1] >= ChessSearch.MATE_THRESHOLD]
+    if mates:
+        return max(mates, key=lambda iteration: iteration[1])
+    alive = [iterations for iterations in finished if iterations[-1][1] > -ChessSearch.MATE_THRESHOLD]
+    if not alive:
+        return max(last, key=lambda iteration: iteration[1])
+    depth = min(iterations[-1][0] for iterations in alive)
+    return max((iterations[depth - 1] for iterations in alive), key=lambda iteration: iteration[1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft and best move search on a process pool")
+    parser.add_argument("--depth", type=int, default=4, help="perft depth, or the maximum search depth with --search")
+    parser.add_argument("--position", default="start",
+                        help="a stored perft position name (" + ", ".join(ChessPerft.POSITIONS) + ") or a FEN string")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--search", action="store_true", help="search for the best move instead of counting nodes")
+    parser.add_argument("--time", type=float, default=None, help="search time limit in seconds")
+    args = parser.parse_args(argv)
+
+    if args.position in ChessPerft.POSITIONS:
+        fen, counts = ChessPerft.POSITIONS[args.position]
+        name = args.position
+    else:
+        fen, counts, name = args.position, {}, "fen"
+    try:
+        gs = ChessPerft.position(fen)
+    except ValueError as e:
+        parser.error(str(e))
+    with ParallelEngine(args.workers) as engine:
+        if args.search:
+            print(engine.search(gs, args.depth, args.time))
+            return 0
+        start = time.perf_counter()
+        nodes = engine.perft(gs, args.depth)
+        result = ChessPerft.PerftResult(name, args.depth, nodes, time.perf_counter() - start, counts.get(args.depth))
+        print("%s (%d workers)" % (result, engine.workers))
+        return 0 if result.passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+responsible for counting the leaf nodes of the move tree (perft) to check and time the move generator,
+responsible for comparing the counts against stored reference counts.
+run from the project root with: python -m Chess.ChessPerft --depth 4
+"""
+import argparse
+import sys
+import time
+
+from Chess import ChessEngine
+
+#test positions and their reference node counts per depth
+#counts follow the engine's rules: no castling, en-passant or promotion, so some differ from published perft tables
+#(the start position is the published count up to depth 4, depth 5 is 258 en-passant captures short of it)
+POSITIONS = {
+    "start": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w",
+              {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865351}),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w",
+                 {1: 46, 2: 1865, 3: 86585}),
+    "endgame": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w",
+                {1: 14, 2: 191, 3: 2810, 4: 43087, 5: 671300}),
+    "italian": ("r1bqkb1r/pppp1ppp/2n2n2/4p3/2B1P3/5N2/PPPP1PPP/RNBQK2R w",
+                {1: 32, 2: 901, 3: 28955, 4: 862064}),
+    "pins": ("4k3/8/8/8/1b5q/8/3PPP2/r2QKB1r w",
+             {1: 5, 2: 205, 3: 1933, 4: 73857, 5: 1090013}),
+    "kqk": ("8/8/8/4k3/8/8/4K3/4Q3 w",
+            {1: 21, 2: 115, 3: 3042, 4: 14914, 5: 397877}),
+    "krk": ("4k3/8/8/8/8/8/8/R3K3 w",
+            {1: 15, 2: 68, 3: 1242, 4: 7374, 5: 140753}),
+}
+
+
+class PerftResult():
+    def __init__(self, name, depth, nodes, seconds, expected=None):
+        self.name = name
+        self.depth = depth
+        self.nodes = nodes
+        self.seconds = seconds
+        self.expected = expected #reference count, None if there is none for this depth
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def passed(self):
+        return self.expected is None or self.nodes == self.expected
+
+    def __str__(self):
+        if self.expected is None:
+            status = "no reference"
+        else:
+            status = "ok" if self.passed else "FAIL (expected %d)" % self.expected
+        return "%-10s depth %d: %12d nodes %8.2fs %10.0f nodes/s  %s" % (
+            self.name, self.depth, self.nodes, self.seconds, self.nodes_per_second, status)
+
+
+'''
+counts the leaf nodes of the legal move tree to the given depth
+the last ply is counted from the length of the move list without making the moves
+'''
+def perft(gs, depth):
+    if depth == 0:
+        return 1
+    moves = gs.get_valid_moves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.make_move(move)
+        nodes += perft(gs, depth - 1)
+        gs.undo_move()
+    return nodes
+
+'''
+perft split by root move, returns a list of (move, nodes) to find which move a wrong count comes from
+'''
+def divide(gs, depth):
+    results = []
+    for move in gs.get_valid_moves():
+        gs.make_move(move)
+        results.append((move, perft(gs, depth - 1) if depth > 1 else 1))
+        gs.undo_move()
+    return results
+
+'''
+returns a GameState set up from the FEN string
+'''
+def position(fen):
+    gs = ChessEngine.GameState()
+    gs.load_fen(fen)
+    return gs
+
+'''
+runs perft on a stored test position and times it
+'''
+def run_position(name, depth):
+    fen, counts = POSITIONS[name]
+    gs = position(fen)
+    start = time.perf_counter()
+    nodes = perft(gs, depth)
+    return PerftResult(name, depth, nodes, time.perf_counter() - start, counts.get(depth))
+
+'''
+runs every stored position up to max_depth, only at depths that have a reference count
+'''
+def run_suite(max_depth, names=None):
+    results = []
+    for name in names or POSITIONS:
+        for depth in sorted(POSITIONS[name][1]):
+            if depth <= max_depth:
+                results.append(run_position(name, depth))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="perft node counts and move generation speed")
+    parser.add_argument("--depth", type=int, default=3, help="search depth (the maximum depth for --suite)")
+    parser.add_argument("--position", default="start",
+                        help="a stored position name (" + ", ".join(POSITIONS) + ") or a FEN string")
+    parser.add_argument("--divide", action="store_true", help="print the node count below each root move")
+    parser.add_argument("--suite", action="store_true", help="run all stored positions against their reference counts")
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        results = run_suite(args.depth)
+        for result in results:
+            print(result)
+        nodes = sum(result.nodes for result in results)
+        seconds = sum(result.seconds for result in results)
+        print("total: %d nodes in %.2fs, %.0f nodes/s" % (nodes, seconds, nodes / seconds if seconds else 0.0))
+        return 0 if all(result.passed for result in results) else 1
+
+    if args.position in POSITIONS:
+        name = args.position
+        fen, counts = POSITIONS[name]
+        expected = counts.get(args.depth)
+    else:
+        name = "fen"
+        fen = args.position
+        expected = None
+    try:
+        gs = position(fen)
+    except ValueError as e:
+        parser.error(str(e))
+    start = time.perf_counter()
+    if args.divide:
+        split = divide(gs, args.depth)
+        for move, nodes in split:
+            print("%s: %d" % (move.get_chess_notation(), nodes))
+        nodes = sum(nodes for move, nodes in split)
+    else:
+        nodes = perft(gs, args.depth)
+    result = PerftResult(name, args.depth, nodes, time.perf_counter() - start, expected)
+    print(result)
+    return 0 if result.passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
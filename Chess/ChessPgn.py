@@ -0,0 +1,259 @@
+"""
+responsible for standard algebraic notation (SAN) and reading and writing PGN games,
+responsible for validating large PGN files: games are streamed from the file and replayed on worker processes.
+run from the project root with: python -m Chess.ChessPgn games.pgn --workers 8 --output report.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import ChessEngine
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(=[NBRQ])?$")
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"(.*)"\]\s*$')
+#comments, rest of line comments, NAGs and move numbers are skipped when reading movetext
+MOVETEXT_NOISE = re.compile(r"\{[^}]*\}|;[^\n]*|\$\d+|\d+\.(\.\.)?")
+
+
+class SanError(ValueError):
+    pass
+
+
+class PgnGame():
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {} #tag name -> value, in file order
+        self.moves = moves if moves is not None else [] #SAN strings
+        self.result = result
+
+
+'''
+the SAN of a legal move in the position before it is made, e.g. "Nbd7", "exd5", "Qh5+" or "Qxf7#"
+'''
+def move_to_san(gs, move):
+    piece = move.piece_moved[1]
+    end = move.get_rank_file(move.end_row, move.end_col)
+    capture = move.piece_captured != "--"
+    if piece == "P":
+        san = (move.cols_to_files[move.start_col] + "x" if capture else "") + end
+    else:
+        #another piece of the same type that can reach the same square makes the move ambiguous
+        others = [other for other in gs.get_valid_moves() if other.piece_moved == move.piece_moved and
+                  other.end_row == move.end_row and other.end_col == move.end_col and other != move]
+        disambiguation = ""
+        if others:
+            if all(other.start_col != move.start_col for other in others):
+                disambiguation = move.cols_to_files[move.start_col]
+            elif all(other.start_row != move.start_row for other in others):
+                disambiguation = move.rows_to_ranks[move.start_row]
+            else:
+                disambiguation = move.get_rank_file(move.start_row, move.start_col)
+        san = piece + disambiguation + ("x" if capture else "") + end
+    gs.make_move(move)
+    replies = gs.get_valid_moves()
+    if gs.in_check:
+        san += "#" if not replies else "+"
+    gs.undo_move()
+    return san
+
+'''
+the legal move for a SAN string in the position, raises SanError if it is not a legal move here
+'''
+def san_to_move(gs, san):
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "O-O-O", "0-0", "0-0-0"):
+        raise SanError("castling is not supported by the engine: " + san)
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise SanError("not a SAN move: " + san)
+    piece, from_file, from_rank, capture, end, promotion = match.groups()
+    if promotion:
+        raise SanError("promotion is not supported by the engine: " + san)
+    piece = piece or "P"
+    end_col = ChessEngine.Move.files_to_cols[end[0]]
+    end_row = ChessEngine.Move.ranks_to_rows[end[1]]
+    candidates = [move for move in gs.get_valid_moves() if move.piece_moved[1] == piece and
+                  move.end_row == end_row and move.end_col == end_col and
+                  (from_file is None or move.start_col == ChessEngine.Move.files_to_cols[from_file]) and
+                  (from_rank is None or move.start_row == ChessEngine.Move.ranks_to_rows[from_rank])]
+    if not candidates:
+        raise SanError("illegal move: " + san)
+    if len(candidates) > 1:
+        raise SanError("ambiguous move: " + san)
+    return candidates[0]
+
+'''
+writes a game as PGN text, moves is a list of Move objects played from start_fen (a GameState.moveLog works)
+annotations is an optional list with movetext to put after each move, e.g. "$2 {a comment}", None or "" for nothing
+'''
+def write_pgn(moves, headers=None, result="*", start_fen=None, annotations=None):
+    tags = {"Event": "?", "Site": "?", "Date": "????.??.??", "Round": "?", "White": "?", "Black": "?"}
+    tags.update(headers or {})
+    tags["Result"] = result
+    gs = ChessEngine.GameState()
+    if start_fen is not None:
+        gs.load_fen(start_fen)
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_fen
+    lines = ['[%s "%s"]' % (name, value.replace('"', "'")) for name, value in tags.items()]
+    lines.append("")
+    tokens = []
+    for i, move in enumerate(moves):
+        if gs.whiteToMove:
+            tokens.append("%d." % (len(gs.moveLog) // 2 + 1))
+        elif not tokens or (annotations and annotations[i - 1]): #black's move number is repeated after a comment
+            tokens.append("%d..." % (len(gs.moveLog) // 2 + 1))
+        move = gs.get_valid_moves().get(move.move_id) or move
+        tokens.append(move_to_san(gs, move))
+        if annotations and annotations[i]:
+            tokens.extend(annotations[i].split()) #split into words so long comments wrap like the moves
+        gs.make_move(move)
+    tokens.append(result)
+    line = ""
+    for token in tokens: #movetext lines are kept under 80 characters
+        if line and len(line) + 1 + len(token) > 79:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n"
+
+'''
+splits a stream of PGN lines into the text of each game, one game at a time so files of any size can be read
+'''
+def iter_game_texts(lines):
+    game = []
+    in_movetext = False
+    for line in lines:
+        if line.startswith("[") and in_movetext: #a tag after movetext starts the next game
+            yield "".join(game)
+            game = []
+            in_movetext = False
+        if line.strip() and not line.startswith("["):
+            in_movetext = True
+        game.append(line)
+    if any(line.strip() for line in game):
+        yield "".join(game)
+
+'''
+parses the text of one game into a PgnGame, variations are dropped
+'''
+def parse_game(text):
+    game = PgnGame()
+    movetext = []
+    for line in text.splitlines():
+        match = TAG_PATTERN.match(line.strip())
+        if match:
+            game.headers[match.group(1)] = match.group(2)
+        elif not line.startswith("%"):
+            movetext.append(line)
+    body = MOVETEXT_NOISE.sub(" ", "\n".join(movetext))
+    depth = 0
+    for token in body.replace("(", " ( ").replace(")", " ) ").split():
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            if token in RESULTS:
+                game.result = token
+            else:
+                game.moves.append(token)
+    return game
+
+'''
+reads the games of a PGN file one at a time
+'''
+def read_pgn(path):
+    with open(path, encoding="utf-8", errors="replace") as pgn_file:
+        for text in iter_game_texts(pgn_file):
+            yield parse_game(text)
+
+'''
+replays a game through make_move against get_valid_moves and returns a report dict:
+the number of moves played, the first illegal move if there is one and the FEN of the final position
+'''
+def validate_game(game):
+    gs = ChessEngine.GameState()
+    report = {"white": game.headers.get("White", "?"), "black": game.headers.get("Black", "?"),
+              "result": game.result, "plies": 0, "error": None}
+    try:
+        if game.headers.get("FEN"):
+            gs.load_fen(game.headers["FEN"])
+        for ply, san in enumerate(game.moves):
+            try:
+                move = san_to_move(gs, san)
+            except SanError as e:
+                report["error"] = {"ply": ply, "san": san, "reason": str(e)}
+                break
+            gs.make_move(move)
+    except ValueError as e: #a bad FEN tag
+        report["error"] = {"ply": 0, "san": None, "reason": str(e)}
+    report["plies"] = len(gs.moveLog)
+    report["fen"] = gs.get_fen()
+    return report
+
+def _validate_batch(texts):
+    return [validate_game(parse_game(text)) for text in texts]
+
+'''
+validates every game of a PGN file on a pool of worker processes and yields the reports in file order
+the file is read as a stream of batches and only a few batches per worker are in flight, so memory stays bounded
+'''
+def validate_file(path, workers=None, batch_size=200):
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor, \
+            open(path, encoding="utf-8", errors="replace") as pgn_file:
+        pending = deque()
+        batch = []
+        for text in iter_game_texts(pgn_file):
+            batch.append(text)
+            if len(batch) == batch_size:
+                pending.append(executor.submit(_validate_batch, batch))
+                batch = []
+                while len(pending) >= max_in_flight:
+                    yield from pending.popleft().result()
+        if batch:
+            pending.append(executor.submit(_validate_batch, batch))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="replay every game of a PGN file and report illegal moves")
+    parser.add_argument("pgn", help="PGN file to validate")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=200, help="games per task sent to a worker")
+    parser.add_argument("--output", default="-", help="JSON lines report file, - for stdout")
+    args = parser.parse_args(argv)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    games = illegal = plies = 0
+    start = time.perf_counter()
+    try:
+        for number, report in enumerate(validate_file(args.pgn, args.workers, args.batch_size)):
+            report["game"] = number
+            output.write(json.dumps(report) + "\n")
+            games += 1
+            plies += report["plies"]
+            illegal += report["error"] is not None
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    seconds = time.perf_counter() - start
+    print("%d games, %d moves replayed, %d with illegal or unsupported moves in %.2fs (%.1f games/s)" % (
+        games, plies, illegal, seconds, games / seconds if seconds else 0.0), file=sys.stderr)
+    return 0 if illegal == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
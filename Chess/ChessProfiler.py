@@ -0,0 +1,189 @@
+"""
+responsible for measuring where move generation (get_valid_moves and get_staged_moves) spends its time:
+calls, moves generated and time for every phase and every per-piece generator of a GameState.
+profiling is switched on by putting timing wrappers in front of the GameState methods (instance attributes that shadow
+the class methods, and a wrapped move_functions table) and off by taking them away again,
+so a GameState that is not being profiled runs exactly the same code as before.
+"""
+import json
+import time
+
+from Chess import ChessEngine
+
+#the phases of get_valid_moves and of the staged generation the search uses, every one is a GameState method
+#set_move_masks is the check evasion and pin mask phase of both
+PHASES = ("get_valid_moves", "generate_valid_moves", "get_staged_moves", "set_move_masks",
+          "check_for_pins_and_checks", "attacked_squares", "get_possible_moves")
+#the entry points whose times add up to all the time spent generating moves
+TOTALS = ("get_valid_moves", "get_staged_moves")
+#the generator behind each move_functions entry
+GENERATORS = {'P': "get_pawn_moves", 'R': "get_rook_moves", 'N': "get_knight_moves", 'B': "get_bishop_moves",
+              'K': "get_king_moves", 'Q': "get_queen_moves"}
+
+
+class MoveGenProfiler():
+    '''
+    profiles any number of GameStates into one set of counters, attach starts profiling a GameState and detach stops it
+    with count_move_objects, the Move objects made from move codes (Move.from_code) are counted and timed too,
+    that wrapper is on the class so it is shared by every GameState while any profiler counts them
+    '''
+    def __init__(self, count_move_objects=False):
+        self.records = {} #name -> [calls, moves, seconds]
+        self.attached = [] #(GameState, original move_functions)
+        self.count_move_objects = count_move_objects
+        self.original_from_code = None
+        self.started = time.perf_counter()
+
+    def record(self, name):
+        if name not in self.records:
+            self.records[name] = [0, 0, 0.0]
+        return self.records[name]
+
+    '''
+    a wrapper for a method that returns a MoveList (or nothing), moves counts the length of what it returned
+    '''
+    def timed_phase(self, name, function):
+        record = self.record(name)
+        perf_counter = time.perf_counter
+
+        def phase(*args):
+            start = perf_counter()
+            result = function(*args)
+            record[2] += perf_counter() - start
+            record[0] += 1
+            if isinstance(result, ChessEngine.MoveList):
+                record[1] += len(result)
+            return result
+        return phase
+
+    '''
+    a wrapper for get_staged_moves: the moves are generated a stage at a time while the caller iterates,
+    so the time is the set up plus the time spent inside the generator for each move it yields,
+    the caller's work between moves (making them and searching below them) is not counted
+    '''
+    def timed_stages(self, name, function):
+        record = self.record(name)
+        perf_counter = time.perf_counter
+
+        def stages(*args, **kwargs):
+            start = perf_counter()
+            moves = function(*args, **kwargs)
+            record[2] += perf_counter() - start
+            record[0] += 1
+            return self.timed_iteration(record, moves)
+        return stages
+
+    def timed_iteration(self, record, moves):
+        perf_counter = time.perf_counter
+        while True:
+            start = perf_counter()
+            move = next(moves, None)
+            record[2] += perf_counter() - start
+            if move is None:
+                return
+            record[1] += 1
+            yield move
+
+    '''
+    a wrapper for a per-piece generator, moves counts the moves it appended to the list it was given
+    '''
+    def timed_generator(self, name, function):
+        record = self.record(name)
+        perf_counter = time.perf_counter
+
+        def generator(r, c, moves):
+            before = len(moves.codes)
+            start = perf_counter()
+            function(r, c, moves)
+            record[2] += perf_counter() - start
+            record[0] += 1
+            record[1] += len(moves.codes) - before
+        return generator
+
+    def attach(self, gs):
+        if any(attached is gs for attached, move_functions in self.attached):
+            return
+        for name in PHASES:
+            wrapper = self.timed_stages if name == "get_staged_moves" else self.timed_phase
+            setattr(gs, name, wrapper(name, getattr(gs, name)))
+        wrapped = {}
+        for piece, name in GENERATORS.items():
+            generator = self.timed_generator(name, getattr(gs, name))
+            setattr(gs, name, generator) #generate_valid_moves calls get_king_moves directly in double check
+            wrapped[piece] = generator
+        #the same order as the original table, so moves are generated in the same order
+        self.attached.append((gs, gs.move_functions))
+        gs.move_functions = {piece: wrapped[piece] for piece in gs.move_functions}
+        if self.count_move_objects and self.original_from_code is None:
+            self.original_from_code = ChessEngine.Move.__dict__["from_code"]
+            record = self.record("Move.from_code")
+            from_code = ChessEngine.Move.from_code
+            perf_counter = time.perf_counter
+
+            def timed_from_code(cls, code):
+                start = perf_counter()
+                move = from_code(code)
+                record[2] += perf_counter() - start
+                record[0] += 1
+                return move
+            ChessEngine.Move.from_code = classmethod(timed_from_code)
+
+    def detach(self, gs):
+        for i, (attached, move_functions) in enumerate(self.attached):
+            if attached is gs:
+                for name in PHASES + tuple(GENERATORS.values()):
+                    gs.__dict__.pop(name, None) #the class method is found again
+                gs.move_functions = move_functions
+                del self.attached[i]
+                break
+        if not self.attached and self.original_from_code is not None:
+            ChessEngine.Move.from_code = self.original_from_code
+            self.original_from_code = None
+
+    def detach_all(self):
+        for gs, move_functions in list(self.attached):
+            self.detach(gs)
+
+    def reset(self):
+        for record in self.records.values():
+            record[:] = [0, 0, 0.0]
+        self.started = time.perf_counter()
+
+    '''
+    {name: {"calls", "moves", "seconds", "us_per_call", "share"}} sorted by time, share is the fraction of the time
+    spent generating moves: in get_valid_moves (or generate_valid_moves if get_valid_moves was not called)
+    and in get_staged_moves, which do not call each other
+    '''
+    def stats(self):
+        total = 0.0
+        for name in TOTALS:
+            if name in self.records:
+                total += self.records[name][2]
+        if not self.records.get("get_valid_moves", [0, 0, 0.0])[2] and "generate_valid_moves" in self.records:
+            total += self.records["generate_valid_moves"][2]
+        stats = {}
+        for name, (calls, moves, seconds) in sorted(self.records.items(), key=lambda item: -item[1][2]):
+            stats[name] = {"calls": calls, "moves": moves, "seconds": seconds,
+                           "us_per_call": seconds / calls * 1e6 if calls else 0.0,
+                           "share": seconds / total if total else 0.0}
+        return stats
+
+    '''
+    the stats as JSON, written to path if one is given
+    '''
+    def dump_json(self, path=None):
+        text = json.dumps({"wall_seconds": time.perf_counter() - self.started, "stats": self.stats()}, indent=2)
+        if path is not None:
+            with open(path, "w") as profile_file:
+                profile_file.write(text + "\n")
+        return text
+
+    '''
+    one line per phase and generator, for printing or for the ChessMain overlay
+    '''
+    def report_lines(self):
+        lines = ["%-26s %8s %8s %9s %6s" % ("", "calls", "moves", "us/call", "share")]
+        for name, stat in self.stats().items():
+            lines.append("%-26s %8d %8d %9.1f %5.1f%%" % (name, stat["calls"], stat["moves"], stat["us_per_call"],
+                                                          100 * stat["share"]))
+        return lines
@@ -0,0 +1,389 @@
+"""
+responsible for picking a move: negamax alpha-beta search with iterative deepening and quiescence on captures,
+responsible for evaluating positions with material and piece-square tables,
+responsible for keeping the search inside a wall-clock or node budget.
+"""
+import time
+
+from Chess import ChessEngine
+from Chess.ChessTransposition import TranspositionTable, EXACT, LOWER_BOUND, UPPER_BOUND
+
+MATE_SCORE = 100000
+#scores above this are mates, their distance from MATE_SCORE is the number of plies to mate
+MATE_THRESHOLD = MATE_SCORE - 1000
+MAX_PLY = 64
+#check evasions are searched in quiescence only this many plies past the horizon, deeper a check is scored statically
+QUIESCENCE_CHECK_PLIES = 2
+#a capture is skipped in quiescence when even winning the piece and this much more would not raise alpha
+DELTA_MARGIN = 200
+
+PIECE_VALUES = {'P': 100, 'N': 320, 'B': 330, 'R': 500, 'Q': 900, 'K': 0}
+#piece values used to order captures, most valuable victim first then least valuable attacker
+ORDER_VALUES = {'P': 1, 'N': 3, 'B': 3, 'R': 5, 'Q': 9, 'K': 10}
+
+#piece-square tables from white's point of view, row 0 is the 8th rank like GameState.board
+PIECE_SQUARE_TABLES = {
+    'P': [0, 0, 0, 0, 0, 0, 0, 0,
+          50, 50, 50, 50, 50, 50, 50, 50,
+          10, 10, 20, 30, 30, 20, 10, 10,
+          5, 5, 10, 25, 25, 10, 5, 5,
+          0, 0, 0, 20, 20, 0, 0, 0,
+          5, -5, -10, 0, 0, -10, -5, 5,
+          5, 10, 10, -20, -20, 10, 10, 5,
+          0, 0, 0, 0, 0, 0, 0, 0],
+    'N': [-50, -40, -30, -30, -30, -30, -40, -50,
+          -40, -20, 0, 0, 0, 0, -20, -40,
+          -30, 0, 10, 15, 15, 10, 0, -30,
+          -30, 5, 15, 20, 20, 15, 5, -30,
+          -30, 0, 15, 20, 20, 15, 0, -30,
+          -30, 5, 10, 15, 15, 10, 5, -30,
+          -40, -20, 0, 5, 5, 0, -20, -40,
+          -50, -40, -30, -30, -30, -30, -40, -50],
+    'B': [-20, -10, -10, -10, -10, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 10, 10, 5, 0, -10,
+          -10, 5, 5, 10, 10, 5, 5, -10,
+          -10, 0, 10, 10, 10, 10, 0, -10,
+          -10, 10, 10, 10, 10, 10, 10, -10,
+          -10, 5, 0, 0, 0, 0, 5, -10,
+          -20, -10, -10, -10, -10, -10, -10, -20],
+    'R': [0, 0, 0, 0, 0, 0, 0, 0,
+          5, 10, 10, 10, 10, 10, 10, 5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          -5, 0, 0, 0, 0, 0, 0, -5,
+          0, 0, 0, 5, 5, 0, 0, 0],
+    'Q': [-20, -10, -10, -5, -5, -10, -10, -20,
+          -10, 0, 0, 0, 0, 0, 0, -10,
+          -10, 0, 5, 5, 5, 5, 0, -10,
+          -5, 0, 5, 5, 5, 5, 0, -5,
+          0, 0, 5, 5, 5, 5, 0, -5,
+          -10, 5, 5, 5, 5, 5, 0, -10,
+          -10, 0, 5, 0, 0, 0, 0, -10,
+          -20, -10, -10, -5, -5, -10, -10, -20],
+    'K': [-30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -30, -40, -40, -50, -50, -40, -40, -30,
+          -20, -30, -30, -40, -40, -30, -30, -20,
+          -10, -20, -20, -20, -20, -20, -20, -10,
+          20, 20, 0, 0, 0, 0, 20, 20,
+          20, 30, 10, 0, 0, 10, 30, 20],
+}
+
+#material plus piece-square value of each piece on each square, black squares are mirrored top to bottom
+SQUARE_VALUES = {}
+for _piece, _table in PIECE_SQUARE_TABLES.items():
+    SQUARE_VALUES["w" + _piece] = [PIECE_VALUES[_piece] + _table[sq] for sq in range(64)]
+    SQUARE_VALUES["b" + _piece] = [PIECE_VALUES[_piece] + _table[sq ^ 56] for sq in range(64)]
+
+'''
+static evaluation in centipawns from the point of view of the side to move
+'''
+def evaluate(gs):
+    score = 0
+    bitboards = gs.bitboards
+    for code, piece in enumerate(ChessEngine.PIECES, 1):
+        values = SQUARE_VALUES[piece]
+        total = 0
+        for sq in ChessEngine.squares_of(bitboards[code]):
+            total += values[sq]
+        score += total if piece[0] == "w" else -total
+    return score if gs.whiteToMove else -score
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchResult():
+    def __init__(self, best_move, score, pv, nodes, depth, seconds):
+        self.best_move = best_move #None if there are no legal moves
+        self.score = score #centipawns for the side to move, mates are near +-MATE_SCORE
+        self.pv = pv #principal variation, a list of moves starting with best_move
+        self.nodes = nodes
+        self.depth = depth #deepest completed iteration
+        self.seconds = seconds
+        self.iterations = [] #(depth, score, pv) of every completed iteration, set by Searcher.search
+
+    def __str__(self):
+        return "depth %d score %d nodes %d time %.3fs pv %s" % (
+            self.depth, self.score, self.nodes, self.seconds, " ".join(move.get_chess_notation() for move in self.pv))
+
+
+class Searcher():
+    '''
+    a searcher keeps its transposition table and history between calls, so reuse one for many short searches
+    '''
+    def __init__(self, tt_size_mb=16):
+        self.tt = TranspositionTable(tt_size_mb)
+        self.history = {} #(piece, end square) -> score of quiet moves that caused cutoffs
+        self.killers = [[None, None] for ply in range(MAX_PLY + 1)]
+        self.nodes = 0
+        self.deadline = None
+        self.node_limit = None
+        self.path = [] #zobrist keys from the root to the current node for repetition detection
+        self.root_move_ids = None #when set, only these root moves are searched
+        self.root_best_move = None #best move of the last completed root search
+
+    '''
+    searches the position with iterative deepening until max_depth, time_limit seconds or node_limit nodes
+    and returns the result of the deepest completed iteration, the position is left as it was
+    root_move_ids restricts the search to those root moves (by Move.move_id), for splitting the root between processes
+    '''
+    def search(self, gs, max_depth=MAX_PLY, time_limit=None, node_limit=None, root_move_ids=None):
+        start = time.perf_counter()
+        self.nodes = 0
+        self.deadline = start + time_limit if time_limit is not None else None
+        self.node_limit = node_limit
+        self.killers = [[None, None] for ply in range(MAX_PLY + 1)]
+        self.history = {history_key: value // 2 for history_key, value in self.history.items() if value > 1} #age old history
+        self.tt.new_search()
+        self.root_move_ids = set(root_move_ids) if root_move_ids is not None else None
+        root_moves = gs.get_valid_moves()
+        if self.root_move_ids is not None:
+            root_moves = [move for move in root_moves if move.move_id in self.root_move_ids]
+        if not root_moves:
+            score = -MATE_SCORE if gs.in_check else 0
+            return SearchResult(None, score, [], 0, 0, time.perf_counter() - start)
+        fallback = static_best_move(gs, root_moves) #if depth 1 does not finish
+        result = SearchResult(fallback, 0, [fallback], 0, 0, 0.0)
+        iterations = []
+        log_length = len(gs.moveLog)
+        self.root_best_move = None
+        for depth in range(1, min(max_depth, MAX_PLY) + 1):
+            self.path = []
+            try:
+                score = self.negamax(gs, depth, 0, -MATE_SCORE - 1, MATE_SCORE + 1)
+            except SearchTimeout:
+                while len(gs.moveLog) > log_length: #take back the moves of the interrupted iteration
+                    gs.undo_move()
+                break
+            pv = self.principal_variation(gs, depth)
+            iterations.append((depth, score, pv))
+            result = SearchResult(pv[0] if pv else fallback, score, pv, self.nodes, depth,
+                                  time.perf_counter() - start)
+            if abs(score) >= MATE_THRESHOLD: #a forced mate was found, deeper searches will not change it
+                break
+            if self.deadline is not None and time.perf_counter() - start > (self.deadline - start) / 2:
+                break #the next iteration takes several times longer, so it would not finish in the time left
+        result.iterations = iterations
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - start
+        return result
+
+    '''
+    stops the search once the budget is used up, the clock is only read every 64 nodes
+    '''
+    def check_budget(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchTimeout()
+        if self.deadline is not None and self.nodes & 63 == 0 and time.perf_counter() >= self.deadline:
+            raise SearchTimeout()
+
+    def negamax(self, gs, depth, ply, alpha, beta):
+        self.nodes += 1
+        self.check_budget()
+        key = gs.zobrist_key
+        if ply > 0 and key in self.path: #repeating a position on the search path is a draw
+            return 0
+        if depth <= 0 or ply >= MAX_PLY:
+            return self.quiescence(gs, ply, 0, alpha, beta)
+
+        original_alpha = alpha
+        tt_move_id = 0
+        entry = self.tt.probe(key)
+        if entry is not None:
+            tt_depth, tt_score, tt_flag, tt_move_id = entry
+            if ply > 0 and tt_depth >= depth:
+                tt_score = score_from_tt(tt_score, ply)
+                if tt_flag == EXACT:
+                    return tt_score
+                if tt_flag == LOWER_BOUND and tt_score >= beta:
+                    return tt_score
+                if tt_flag == UPPER_BOUND and tt_score <= alpha:
+                    return tt_score
+
+        if ply == 0 and self.root_move_ids is not None:
+            moves = [move for move in gs.get_valid_moves() if move.move_id in self.root_move_ids]
+            if self.root_best_move is not None: #the root is not in the table, the last iteration's best goes first
+                tt_move_id = self.root_best_move.move_id
+            self.order_moves(moves, ply, tt_move_id)
+        else: #moves are generated a stage at a time, a cutoff on the hash move or a capture skips the quiet moves
+            moves = gs.get_staged_moves(tt_move_id, self.quiet_move_key(ply))
+        in_check = gs.in_check #set before any move is made, the child nodes overwrite it
+
+        best_score = -MATE_SCORE - 1
+        best_move = None
+        self.path.append(key)
+        for move in moves:
+            gs.make_move(move)
+            score = -self.negamax(gs, depth - 1, ply + 1, -beta, -alpha)
+            gs.undo_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        if move.piece_captured == "--": #quiet move that refuted the line, try it early next time
+                            if self.killers[ply][0] != move:
+                                self.killers[ply][1] = self.killers[ply][0]
+                                self.killers[ply][0] = move
+                            history_key = (move.piece_moved, move.end_row * 8 + move.end_col)
+                            self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                        break
+        self.path.pop()
+        if best_move is None: #no legal moves
+            return -MATE_SCORE + ply if in_check else 0
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        if ply == 0:
+            self.root_best_move = best_move
+            if self.root_move_ids is not None: #the best of some root moves only, not the value of the position
+                return best_score
+        self.tt.store(key, depth, score_to_tt(best_score, ply), flag, best_move.move_id)
+        return best_score
+
+    '''
+    searches captures only until the position is quiet, so the static evaluation is not taken in the middle of an exchange
+    qply counts the plies past the horizon: checks are answered with every evasion only in the first
+    QUIESCENCE_CHECK_PLIES of them, so a chain of checking captures cannot run the search dozens of plies deep
+    captures that cannot raise alpha even with DELTA_MARGIN to spare are skipped (delta pruning)
+    '''
+    def quiescence(self, gs, ply, qply, alpha, beta):
+        self.nodes += 1
+        self.check_budget()
+        #captures most valuable victim first, or every evasion when in check
+        moves = gs.get_staged_moves(captures_only=True)
+        in_check = gs.in_check and qply < QUIESCENCE_CHECK_PLIES
+        stand_pat = None
+        if not in_check: #the side to move may stand pat
+            stand_pat = evaluate(gs)
+            if stand_pat >= beta or ply >= MAX_PLY or gs.in_check: #too deep to answer the check, take the score as is
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+        elif ply >= MAX_PLY:
+            return evaluate(gs)
+        searched = False
+        for move in moves:
+            searched = True
+            if stand_pat is not None and stand_pat + PIECE_VALUES[move.piece_captured[1]] + DELTA_MARGIN <= alpha:
+                continue
+            gs.make_move(move)
+            score = -self.quiescence(gs, ply + 1, qply + 1, -beta, -alpha)
+            gs.undo_move()
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+        if in_check and not searched: #checkmate
+            return -MATE_SCORE + ply
+        return alpha
+
+    '''
+    sorts moves best first: transposition table move, captures by MVV-LVA, killer moves, then quiet moves by history
+    '''
+    def order_moves(self, moves, ply, tt_move_id):
+        quiet_key = self.quiet_move_key(ply)
+
+        def move_score(move):
+            if move.move_id == tt_move_id:
+                return 1 << 30
+            if move.piece_captured != "--":
+                return (1 << 20) + mvv_lva(move)
+            return quiet_key(move)
+
+        moves.sort(key=move_score, reverse=True)
+
+    '''
+    the sort key of quiet moves at a ply: killer moves first, then by history
+    '''
+    def quiet_move_key(self, ply):
+        killers = self.killers[ply]
+        history = self.history
+
+        def quiet_score(move):
+            if move == killers[0]:
+                return 1 << 19
+            if move == killers[1]:
+                return (1 << 19) - 1
+            return history.get((move.piece_moved, move.end_row * 8 + move.end_col), 0)
+        return quiet_score
+
+    '''
+    the best root move of the last iteration, then the best moves stored in the transposition table below it
+    '''
+    def principal_variation(self, gs, depth):
+        pv = []
+        seen = set()
+        for i in range(depth):
+            if i == 0: #the root is not stored when the root moves are restricted
+                move_id = self.root_best_move.move_id if self.root_best_move is not None else 0
+            else:
+                entry = self.tt.probe(gs.zobrist_key)
+                move_id = entry[3] if entry is not None else 0
+            if not move_id or gs.zobrist_key in seen:
+                break
+            seen.add(gs.zobrist_key)
+            move = next((move for move in gs.get_valid_moves() if move.move_id == move_id), None)
+            if move is None:
+                break
+            pv.append(move)
+            gs.make_move(move)
+        for move in pv:
+            gs.undo_move()
+        return pv
+
+'''
+most valuable victim first, then least valuable attacker
+'''
+def mvv_lva(move):
+    return ORDER_VALUES[move.piece_captured[1]] * 16 - ORDER_VALUES[move.piece_moved[1]]
+
+'''
+the move with the best static evaluation after it is made, captures most valuable victim first among equals,
+a cheap move to play when not even the depth 1 search finishes in time
+'''
+def static_best_move(gs, moves):
+    best_move = None
+    best_key = None
+    for move in moves:
+        gs.make_move(move)
+        key = (-evaluate(gs), mvv_lva(move) if move.piece_captured != "--" else -100)
+        gs.undo_move()
+        if best_key is None or key > best_key:
+            best_move = move
+            best_key = key
+    return best_move
+
+'''
+mate scores are stored relative to the node so they stay correct when the position is reached at another ply
+'''
+def score_to_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+def score_from_tt(score, ply):
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+'''
+searches the position with a new searcher, see Searcher.search
+'''
+def find_best_move(gs, max_depth=MAX_PLY, time_limit=None, node_limit=None):
+    return Searcher().search(gs, max_depth, time_limit, node_limit)
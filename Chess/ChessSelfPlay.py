@@ -0,0 +1,187 @@
+"""
+responsible for playing games without the pygame window: two move policies play each other from the start position,
+responsible for sharding the games over worker processes and streaming one JSON line per finished game to a file.
+run from the project root with: python -m Chess.ChessSelfPlay --games 1000 --output games.jsonl
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+from Chess import ChessEngine, ChessSearch
+
+MAX_PLIES = 300
+FIFTY_MOVE_PLIES = 100
+
+
+'''
+move policies take the position, its legal moves (never empty) and the game's random generator and return a move
+'''
+def random_policy(gs, moves, rng):
+    return moves[rng.randrange(len(moves))]
+
+def first_legal_policy(gs, moves, rng):
+    return moves[0]
+
+
+class SearchPolicy():
+    '''
+    plays the move picked by ChessSearch with a node budget per move, the searcher is kept for the whole run
+    '''
+    def __init__(self, nodes=2000, depth=ChessSearch.MAX_PLY):
+        self.nodes = nodes
+        self.depth = depth
+        self.searcher = ChessSearch.Searcher(tt_size_mb=4)
+
+    def __call__(self, gs, moves, rng):
+        result = self.searcher.search(gs, self.depth, node_limit=self.nodes)
+        return result.best_move if result.best_move is not None else moves[0]
+
+
+POLICY_NAMES = ("random", "first", "search")
+
+'''
+builds the policy for a name: random, first or search (search takes the node budget from search_nodes)
+'''
+def make_policy(name, search_nodes=2000):
+    if name == "random":
+        return random_policy
+    if name == "first":
+        return first_legal_policy
+    if name == "search":
+        return SearchPolicy(search_nodes)
+    raise ValueError("unknown policy " + repr(name) + ", expected random, first or search")
+
+'''
+true if neither side has enough material to mate: bare kings or a king and a single knight or bishop against a king
+'''
+def insufficient_material(gs):
+    pieces = [piece for piece in gs.squares if piece != "--" and piece[1] != "K"]
+    return len(pieces) == 0 or (len(pieces) == 1 and pieces[0][1] in "NB")
+
+'''
+plays one game from the start position and returns its record
+'''
+def play_game(white, black, rng, max_plies=MAX_PLIES):
+    gs = ChessEngine.GameState()
+    seen = {gs.zobrist_key: 1} #times each position has occurred, for threefold repetition
+    quiet_plies = 0 #plies since the last capture or pawn move, for the fifty move rule
+    result, termination = "1/2-1/2", "move limit"
+    while len(gs.moveLog) < max_plies:
+        moves = gs.get_valid_moves()
+        if not moves:
+            if gs.in_check:
+                result, termination = ("0-1" if gs.whiteToMove else "1-0"), "checkmate"
+            else:
+                termination = "stalemate"
+            break
+        policy = white if gs.whiteToMove else black
+        move = policy(gs, moves, rng)
+        gs.make_move(move)
+        quiet_plies = 0 if move.piece_captured != "--" or move.piece_moved[1] == "P" else quiet_plies + 1
+        seen[gs.zobrist_key] = seen.get(gs.zobrist_key, 0) + 1
+        if seen[gs.zobrist_key] >= 3:
+            termination = "threefold repetition"
+            break
+        if quiet_plies >= FIFTY_MOVE_PLIES:
+            termination = "fifty move rule"
+            break
+        if insufficient_material(gs):
+            termination = "insufficient material"
+            break
+    return {"result": result, "termination": termination, "plies": len(gs.moveLog),
+            "moves": " ".join(move.get_chess_notation() for move in gs.moveLog)}
+
+
+#policies of a worker process, built once by _init_worker
+_worker_policies = None
+
+
+def _init_worker(white_name, black_name, search_nodes):
+    global _worker_policies
+    _worker_policies = (make_policy(white_name, search_nodes), make_policy(black_name, search_nodes))
+
+'''
+plays the games numbered first to first + count - 1, each with its own seed so a run can be reproduced
+returns (JSON line, result, plies) per game so the parent only writes strings and keeps counts
+'''
+def _play_batch(task):
+    first, count, seed, max_plies = task
+    white, black = _worker_policies
+    lines = []
+    for game in range(first, first + count):
+        record = play_game(white, black, random.Random(seed * 1000003 + game), max_plies)
+        record["game"] = game
+        lines.append((json.dumps(record), record["result"], record["plies"]))
+    return lines
+
+
+class SelfPlayReport():
+    def __init__(self):
+        self.games = 0
+        self.plies = 0
+        self.results = {"1-0": 0, "0-1": 0, "1/2-1/2": 0}
+        self.seconds = 0.0
+
+    def add(self, result, plies):
+        self.games += 1
+        self.plies += plies
+        self.results[result] += 1
+
+    def __str__(self):
+        seconds = self.seconds or 1e-9
+        return "%d games, %d moves in %.2fs: %.1f games/s, %.0f moves/s, results %s" % (
+            self.games, self.plies, self.seconds, self.games / seconds, self.plies / seconds,
+            " ".join("%s: %d" % item for item in self.results.items()))
+
+'''
+plays games between two policies over a pool of worker processes and writes a JSON line per game to output as they finish
+games finish out of order, each line has its "game" number
+'''
+def run(games, output, white="random", black="random", workers=None, batch_size=50, seed=0,
+        max_plies=MAX_PLIES, search_nodes=2000):
+    workers = workers or os.cpu_count() or 1
+    for name in (white, black): #a bad name would kill every worker in its initializer and the pool would respawn them forever
+        make_policy(name, search_nodes)
+    tasks = ((first, min(batch_size, games - first), seed, max_plies) for first in range(0, games, batch_size))
+    report = SelfPlayReport()
+    start = time.perf_counter()
+    with Pool(workers, initializer=_init_worker, initargs=(white, black, search_nodes)) as pool:
+        for lines in pool.imap_unordered(_play_batch, tasks):
+            for line, result, plies in lines:
+                output.write(line + "\n")
+                report.add(result, plies)
+            output.flush()
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="headless self-play over a process pool")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--output", default="-", help="JSON lines file, - for stdout")
+    parser.add_argument("--white", default="random", choices=POLICY_NAMES)
+    parser.add_argument("--black", default="random", choices=POLICY_NAMES)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=50, help="games per task sent to a worker")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-plies", type=int, default=MAX_PLIES)
+    parser.add_argument("--search-nodes", type=int, default=2000, help="node budget per move for the search policy")
+    args = parser.parse_args(argv)
+
+    output = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        report = run(args.games, output, args.white, args.black, args.workers, args.batch_size, args.seed,
+                     args.max_plies, args.search_nodes)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(report, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+responsible for hosting many games over TCP with asyncio: clients send one JSON object per line and get one back,
+and every client that joined a game is pushed an update line when a move is made or taken back in it.
+a game is kept as its position packed by GameState.to_bytes plus an array of move codes, only the most recently
+used games also have a GameState, so memory stays bounded however many games are open.
+run from the project root with: python -m Chess.ChessServer --port 8765
+
+requests (any request may carry an "id", it is copied into the reply):
+    {"op": "new"} or {"op": "new", "fen": "..."}        starts a game and joins it
+    {"op": "join", "game": 1}                           receives the updates of a game
+    {"op": "leave", "game": 1}
+    {"op": "state", "game": 1}
+    {"op": "move", "game": 1, "move": "e2e4"}
+    {"op": "undo", "game": 1}
+    {"op": "close", "game": 1}                          ends a game for everyone
+replies are {"type": "state", ...game fields} or {"type": "error", "reason": "..."},
+pushed updates are {"type": "update", ...game fields}, see GameServer.game_fields
+"""
+import argparse
+import asyncio
+import json
+import sys
+from array import array
+from collections import OrderedDict
+
+from Chess import ChessEngine
+
+MAX_GAMES = 100000
+MAX_ACTIVE = 1024 #games that keep a GameState
+MAX_WRITE_BUFFER = 1 << 20 #a client that lets this many bytes of updates pile up is disconnected
+#Move.get_chess_notation of each start square | end square << 6, so move codes are written without making Move objects
+MOVE_NOTATION = [ChessEngine.Move.from_squares(start, end, "--", "--").get_chess_notation()
+                 for end in range(64) for start in range(64)]
+
+
+class GameRecord():
+    '''
+    a game as it is kept while nobody is using it: the packed position and the codes of the moves that led to it,
+    position is only up to date while the game has no GameState in GameServer.active
+    '''
+    __slots__ = ("game_id", "position", "moves", "subscribers")
+
+    def __init__(self, game_id, position, moves=None):
+        self.game_id = game_id
+        self.position = position #GameState.to_bytes
+        self.moves = moves if moves is not None else array('I') #Move.code of each move played
+        self.subscribers = set() #StreamWriters that get the updates
+
+
+class GameError(Exception):
+    pass
+
+
+'''
+the move_id of a move written as in Move.get_chess_notation, e.g. "e2e4"
+'''
+def notation_to_move_id(text):
+    files_to_cols, ranks_to_rows = ChessEngine.Move.files_to_cols, ChessEngine.Move.ranks_to_rows
+    if not isinstance(text, str) or len(text) != 4 or text[0] not in files_to_cols or text[2] not in files_to_cols \
+            or text[1] not in ranks_to_rows or text[3] not in ranks_to_rows:
+        raise GameError("not a move: %r" % (text,))
+    return ranks_to_rows[text[1]] * 1000 + files_to_cols[text[0]] * 100 + ranks_to_rows[text[3]] * 10 + \
+        files_to_cols[text[2]]
+
+
+class GameServer():
+    '''
+    holds the games and answers requests, handle_request works without a network so the rules can be used directly
+    the GameStates of active games share one MoveCache, so positions common to many games are generated once
+    '''
+    def __init__(self, max_games=MAX_GAMES, max_active=MAX_ACTIVE, move_cache_size=65536):
+        self.max_games = max_games
+        self.max_active = max_active
+        self.games = {} #game_id -> GameRecord
+        self.active = OrderedDict() #game_id -> GameState, least recently used first
+        self.move_cache = ChessEngine.MoveCache(move_cache_size)
+        self.next_game_id = 1
+        self.server = None
+
+    '''
+    the GameState of a game, rebuilt from its record if it is not active, the least recently used game is then stored
+    the move log is rebuilt from the move codes without replaying them, as each code has the piece it captured for undo
+    '''
+    def game_state(self, record):
+        gs = self.active.get(record.game_id)
+        if gs is not None:
+            self.active.move_to_end(record.game_id)
+            return gs
+        gs = ChessEngine.GameState.from_bytes(record.position)
+        gs.moveLog = [ChessEngine.Move.from_code(code) for code in record.moves]
+        gs.enable_move_cache(cache=self.move_cache)
+        self.active[record.game_id] = gs
+        if len(self.active) > self.max_active:
+            game_id, idle = self.active.popitem(last=False)
+            if game_id in self.games:
+                self.games[game_id].position = idle.to_bytes()
+        return gs
+
+    def record(self, message):
+        game_id = message.get("game")
+        if type(game_id) is not int: #not bool either, True would find game 1
+            raise GameError("a game id is a number, got %r" % (game_id,))
+        record = self.games.get(game_id)
+        if record is None:
+            raise GameError("no game %r" % (message.get("game"),))
+        return record
+
+    '''
+    starts a game from the initial position or from fen, which load_fen checks is a position a game can reach
+    '''
+    def new_game(self, fen=None):
+        if len(self.games) >= self.max_games:
+            raise GameError("the server is full")
+        gs = ChessEngine.GameState()
+        if fen is not None:
+            if not isinstance(fen, str):
+                raise GameError("a FEN is a string, got %r" % (fen,))
+            try:
+                gs.load_fen(fen)
+            except ValueError as e:
+                raise GameError("bad FEN: %s" % e)
+        record = GameRecord(self.next_game_id, gs.to_bytes())
+        self.next_game_id += 1
+        self.games[record.game_id] = record
+        return record
+
+    '''
+    the fields sent for a game: its FEN, whose turn it is, the legal moves, the last move, the number of moves played
+    and the status, one of "playing", "checkmate" or "stalemate"
+    '''
+    def game_fields(self, record):
+        gs = self.game_state(record)
+        moves = gs.get_valid_moves()
+        status = "playing" if moves else ("checkmate" if gs.in_check else "stalemate")
+        last = MOVE_NOTATION[record.moves[-1] & 4095] if record.moves else None
+        return {"game": record.game_id, "fen": gs.get_fen(), "turn": "w" if gs.whiteToMove else "b",
+                "legal": [MOVE_NOTATION[code & 4095] for code in moves.codes], "last": last,
+                "plies": len(record.moves), "status": status, "check": gs.in_check}
+
+    '''
+    answers one request, subscriber is the client's StreamWriter (None without a network)
+    returns (reply, update): update is pushed to the other clients of the game when the request changed it
+    '''
+    def handle_request(self, message, subscriber=None):
+        op = message.get("op")
+        if not isinstance(op, str):
+            raise GameError("an op is a string, got %r" % (op,))
+        update = None
+        if op == "new":
+            record = self.new_game(message.get("fen"))
+            if subscriber is not None:
+                record.subscribers.add(subscriber)
+        elif op in ("join", "leave", "state", "move", "undo", "close"):
+            record = self.record(message)
+            if op == "join" and subscriber is not None:
+                record.subscribers.add(subscriber)
+            elif op == "leave":
+                record.subscribers.discard(subscriber)
+            elif op == "move":
+                gs = self.game_state(record)
+                move = gs.get_valid_moves().get(notation_to_move_id(message.get("move")))
+                if move is None:
+                    raise GameError("illegal move: %r" % (message.get("move"),))
+                gs.make_move(move)
+                record.moves.append(move.code)
+                update = True
+            elif op == "undo":
+                if not record.moves:
+                    raise GameError("no move to undo")
+                self.game_state(record).undo_move()
+                record.moves.pop()
+                update = True
+            elif op == "close":
+                del self.games[record.game_id]
+                self.active.pop(record.game_id, None)
+                reply = {"type": "closed", "game": record.game_id}
+                return reply, (dict(reply) if record.subscribers else None)
+        else:
+            raise GameError("unknown op %r" % (op,))
+        reply = self.game_fields(record)
+        reply["type"] = "state"
+        if update:
+            update = dict(reply)
+            update["type"] = "update"
+        return reply, update
+
+    def send(self, writer, message):
+        if writer.transport.get_write_buffer_size() > MAX_WRITE_BUFFER: #a client that does not read is dropped
+            writer.close()
+            return
+        writer.write(json.dumps(message).encode() + b"\n")
+
+    '''
+    pushes an update to every client of the game except the one whose request caused it
+    '''
+    def broadcast(self, record, update, sender):
+        for writer in list(record.subscribers):
+            if writer is sender:
+                continue
+            if writer.is_closing():
+                record.subscribers.discard(writer)
+            else:
+                self.send(writer, update)
+
+    async def handle_client(self, reader, writer):
+        joined = set() #records this client is subscribed to, so they can be left when it goes away
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+                    break
+                if not line:
+                    break
+                request_id = None
+                try:
+                    message = json.loads(line)
+                    if not isinstance(message, dict):
+                        raise GameError("a request is a JSON object")
+                    request_id = message.get("id")
+                    game_id = message.get("game")
+                    record = self.games.get(game_id) if type(game_id) is int else None #before a close removes it
+                    reply, update = self.handle_request(message, writer)
+                    record = record or self.games.get(reply.get("game"))
+                    if record is not None:
+                        if writer in record.subscribers:
+                            joined.add(record)
+                        else:
+                            joined.discard(record)
+                        if update is not None:
+                            self.broadcast(record, update, writer)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    reply = {"type": "error", "reason": "not JSON"}
+                except GameError as e:
+                    reply = {"type": "error", "reason": str(e)}
+                except Exception as e: #a request that breaks a rule the checks above missed only fails itself
+                    reply = {"type": "error", "reason": "internal error: %s" % type(e).__name__}
+                if request_id is not None:
+                    reply["id"] = request_id
+                self.send(writer, reply)
+                await writer.drain()
+        finally:
+            for record in joined:
+                record.subscribers.discard(writer)
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8765):
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server
+
+    async def serve_forever(self, host="127.0.0.1", port=8765):
+        server = await self.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+
+class GameClient():
+    '''
+    a client for GameServer: request sends a request and waits for its reply, pushed updates go to self.updates
+    '''
+    def __init__(self):
+        self.reader = None
+        self.writer = None
+        self.pending = {} #request id -> future of the reply
+        self.next_request_id = 1
+        self.updates = asyncio.Queue()
+        self.read_task = None
+
+    async def connect(self, host="127.0.0.1", port=8765):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.read_task = asyncio.ensure_future(self.read_replies())
+        return self
+
+    async def read_replies(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            future = self.pending.pop(message.get("id"), None)
+            if future is not None:
+                future.set_result(message)
+            else:
+                self.updates.put_nowait(message)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("the server closed the connection"))
+        self.pending = {}
+
+    async def request(self, op, **fields):
+        request_id = self.next_request_id
+        self.next_request_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        fields.update(op=op, id=request_id)
+        self.writer.write(json.dumps(fields).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        if self.read_task is not None:
+            self.read_task.cancel()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="host games over TCP, one JSON request or reply per line")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-games", type=int, default=MAX_GAMES)
+    parser.add_argument("--max-active", type=int, default=MAX_ACTIVE, help="games that keep a GameState in memory")
+    args = parser.parse_args(argv)
+    server = GameServer(args.max_games, args.max_active)
+    print("serving on %s:%d" % (args.host, args.port), file=sys.stderr)
+    try:
+        asyncio.run(server.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
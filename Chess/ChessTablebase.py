@@ -0,0 +1,322 @@
+"""
+responsible for solving endgames with a king and one piece against a bare king (KQK, KRK, KBK, KNK, KPK)
+by retrograde analysis over the engine's own move rules, and for probing the solved tables.
+the rules are the engine's: no promotion, so a pawn that reaches the last rank stays there.
+a table holds one byte per (white king, black king, piece square, side to move), see encode_value,
+it is written as a plain file and probed through mmap, so opening it reads nothing and processes share its pages.
+the strong side is white in the files, positions where black has the piece are probed mirrored.
+run from the project root with: python -m Chess.ChessTablebase generate KQK KRK KPK --workers 8
+"""
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from Chess import ChessEngine
+
+MATERIALS = ("KQK", "KRK", "KBK", "KNK", "KPK")
+TABLE_SIZE = 64 * 64 * 64 * 2
+SIDE_SIZE = TABLE_SIZE // 64 #entries that share a white king square, the unit of work for one task
+
+#results, from the point of view of the side to move
+WIN = 1
+DRAW = 0
+LOSS = -1
+
+#byte values: 0 is an impossible position, 1 a draw, 2 + plies to mate otherwise
+#the parity of the plies tells who mates: an even number means the side to move is mated, an odd one that it mates
+ILLEGAL = 0
+DRAW_VALUE = 1
+MAX_PLIES = 255 - 2
+
+#position status found while generating moves
+_ILLEGAL, _MOVES, _MATE, _STALEMATE = 0, 1, 2, 3
+
+
+'''
+the table entry of a position: white king square, black king square, square of the piece and 0 if white is to move
+'''
+def table_index(white_king, black_king, piece_sq, black_to_move):
+    return ((white_king * 64 + black_king) * 64 + piece_sq) * 2 + black_to_move
+
+def encode_value(result, plies=0):
+    if result == DRAW:
+        return DRAW_VALUE
+    return 2 + plies
+
+'''
+(result, plies to mate) for a table byte, None for an impossible position
+'''
+def decode_value(value):
+    if value == ILLEGAL:
+        return None
+    if value == DRAW_VALUE:
+        return DRAW, 0
+    plies = value - 2
+    return (WIN if plies % 2 else LOSS), plies
+
+def table_path(directory, material):
+    return os.path.join(directory, material + ".tb")
+
+
+'''
+generates the moves of every position with the white king on white_king
+returns (status bytes, total number of moves array, successor offsets array, successor indexes array),
+captures of the piece lead to a bare king draw outside the table so they are counted but have no successor
+'''
+def _moves_task(material, white_king):
+    piece = "w" + material[1]
+    gs = ChessEngine.GameState()
+    board = [["--"] * 8 for r in range(8)]
+    status = bytearray(SIDE_SIZE)
+    move_counts = array('B', bytes(SIDE_SIZE))
+    offsets = array('I', [0])
+    successors = array('I')
+    base = white_king * SIDE_SIZE
+    for black_king in range(64):
+        for piece_sq in range(64):
+            if len({white_king, black_king, piece_sq}) < 3 or ChessEngine.KING_ATTACKS[white_king] >> black_king & 1:
+                offsets.extend((len(successors), len(successors)))
+                continue
+            if piece == "wP" and piece_sq >= 56: #a white pawn can never be on the first rank
+                offsets.extend((len(successors), len(successors)))
+                continue
+            board[white_king // 8][white_king % 8] = "wK"
+            board[black_king // 8][black_king % 8] = "bK"
+            board[piece_sq // 8][piece_sq % 8] = piece
+            for black_to_move in (0, 1):
+                i = table_index(white_king, black_king, piece_sq, black_to_move) - base
+                gs.whiteToMove = not black_to_move
+                gs.set_board(board)
+                if gs.opponent_in_check():
+                    offsets.append(len(successors))
+                    continue
+                moves = gs.generate_valid_moves()
+                if not moves:
+                    status[i] = _MATE if gs.in_check else _STALEMATE
+                else:
+                    status[i] = _MOVES
+                    move_counts[i] = len(moves)
+                    for code in moves.codes:
+                        if code >> 16 & 15: #the piece was taken
+                            continue
+                        start, end = code & 63, code >> 6 & 63
+                        if start == white_king:
+                            successors.append(table_index(end, black_king, piece_sq, 1 - black_to_move))
+                        elif start == black_king:
+                            successors.append(table_index(white_king, end, piece_sq, 1 - black_to_move))
+                        else:
+                            successors.append(table_index(white_king, black_king, end, 1 - black_to_move))
+                offsets.append(len(successors))
+            board[white_king // 8][white_king % 8] = "--"
+            board[black_king // 8][black_king % 8] = "--"
+            board[piece_sq // 8][piece_sq % 8] = "--"
+    return bytes(status), move_counts, offsets, successors
+
+'''
+solves a material set and returns its table as a bytearray of TABLE_SIZE
+the moves of every position are generated on a pool of worker processes, one task per white king square,
+then the results are propagated backwards from the mates one ply at a time
+'''
+def generate_table(material, workers=None):
+    if material not in MATERIALS:
+        raise ValueError("unknown material %r, expected one of %s" % (material, ", ".join(MATERIALS)))
+    workers = workers or os.cpu_count() or 1
+    status = bytearray(TABLE_SIZE)
+    remaining = array('B', bytes(TABLE_SIZE)) #moves of a position not yet known to lose for the side that makes them
+    chunks = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for white_king, (chunk_status, move_counts, offsets, successors) in enumerate(
+                executor.map(_moves_task, [material] * 64, range(64))):
+            base = white_king * SIDE_SIZE
+            status[base:base + SIDE_SIZE] = chunk_status
+            remaining[base:base + SIDE_SIZE] = move_counts
+            chunks.append((offsets, successors))
+
+    #predecessors of each position, stored like the successors: a flat array and the start of each position in it
+    predecessor_starts = array('I', bytes(4 * (TABLE_SIZE + 1)))
+    for offsets, successors in chunks:
+        for target in successors:
+            predecessor_starts[target + 1] += 1
+    for i in range(TABLE_SIZE):
+        predecessor_starts[i + 1] += predecessor_starts[i]
+    fill = array('I', predecessor_starts)
+    predecessors = array('I', bytes(4 * predecessor_starts[TABLE_SIZE]))
+    for white_king, (offsets, successors) in enumerate(chunks):
+        base = white_king * SIDE_SIZE
+        for i in range(SIDE_SIZE):
+            for target in successors[offsets[i]:offsets[i + 1]]:
+                predecessors[fill[target]] = base + i
+                fill[target] += 1
+    del chunks, fill
+
+    table = bytearray(TABLE_SIZE)
+    frontier = []
+    for i, position_status in enumerate(status):
+        if position_status == _MATE:
+            table[i] = encode_value(LOSS, 0)
+            frontier.append(i)
+        elif position_status == _STALEMATE:
+            table[i] = DRAW_VALUE
+    plies = 0
+    while frontier:
+        if plies + 1 > MAX_PLIES:
+            raise ValueError("%s has mates longer than a table byte can hold" % material)
+        value = encode_value(WIN, plies + 1)
+        next_frontier = []
+        for position in frontier:
+            for predecessor in predecessors[predecessor_starts[position]:predecessor_starts[position + 1]]:
+                if table[predecessor]:
+                    continue
+                if plies % 2 == 0: #position loses for its side to move, so the move into it wins
+                    table[predecessor] = value
+                    next_frontier.append(predecessor)
+                else: #position wins for its side to move, the predecessor loses once every move does
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0:
+                        table[predecessor] = value
+                        next_frontier.append(predecessor)
+        frontier = next_frontier
+        plies += 1
+    for i, position_status in enumerate(status):
+        if position_status == _MOVES and not table[i]:
+            table[i] = DRAW_VALUE
+    return table
+
+'''
+writes a table generated by generate_table to directory, returns the path
+'''
+def write_table(table, material, directory="tablebases"):
+    os.makedirs(directory, exist_ok=True)
+    path = table_path(directory, material)
+    with open(path + ".tmp", "wb") as table_file:
+        table_file.write(table)
+    os.replace(path + ".tmp", path) #a reader never sees a half written table
+    return path
+
+'''
+solves a material set and writes its table to directory, returns the path
+'''
+def generate(material, directory="tablebases", workers=None):
+    return write_table(generate_table(material, workers), material, directory)
+
+
+class Tablebase():
+    '''
+    probes the tables found in a directory, each table is memory-mapped the first time it is needed
+    use it as a context manager or call close
+    '''
+    def __init__(self, directory="tablebases"):
+        self.directory = directory
+        self.tables = {} #material -> mmap, or None if there is no file for it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    def table(self, material):
+        if material not in self.tables:
+            path = table_path(self.directory, material)
+            table = None
+            if os.path.exists(path):
+                with open(path, "rb") as table_file:
+                    table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+                if len(table) != TABLE_SIZE:
+                    table.close()
+                    raise ValueError("%s is not a tablebase file, it should be %d bytes" % (path, TABLE_SIZE))
+            self.tables[material] = table
+        return self.tables[material]
+
+    '''
+    (result, plies to mate) for the side to move, or None when the material is not covered by a table here
+    bare kings are always a draw and need no table
+    '''
+    def probe(self, gs):
+        pieces = [(sq, piece) for sq, piece in enumerate(gs.squares) if piece != "--"]
+        if len(pieces) == 2:
+            return DRAW, 0
+        if len(pieces) != 3:
+            return None
+        white_king = gs.bitboards[ChessEngine.PIECE_CODES["wK"]].bit_length() - 1
+        black_king = gs.bitboards[ChessEngine.PIECE_CODES["bK"]].bit_length() - 1
+        piece_sq, piece = [(sq, piece) for sq, piece in pieces if piece[1] != "K"][0]
+        black_to_move = 0 if gs.whiteToMove else 1
+        if piece[0] == "b": #the tables have the piece on white's side, so the board is mirrored and the colours swapped
+            white_king, black_king, piece_sq = black_king ^ 56, white_king ^ 56, piece_sq ^ 56
+            black_to_move = 1 - black_to_move
+        table = self.table("K" + piece[1] + "K")
+        if table is None:
+            return None
+        return decode_value(table[table_index(white_king, black_king, piece_sq, black_to_move)])
+
+    '''
+    the move that mates fastest when winning, keeps the draw when drawing and mates slowest when losing,
+    None when the position is not covered or has no moves
+    '''
+    def best_move(self, gs):
+        best, best_rank = None, None
+        for move in gs.get_valid_moves():
+            gs.make_move(move)
+            probed = self.probe(gs)
+            gs.undo_move()
+            if probed is None:
+                return None
+            result, plies = probed #for the opponent
+            rank = (-result, -plies if result == LOSS else plies)
+            if best_rank is None or rank > best_rank:
+                best, best_rank = move, rank
+        return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="solve and probe king and piece against king endgames")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate", help="solve material sets and write their tables")
+    generate_parser.add_argument("materials", nargs="*", default=list(MATERIALS), help=", ".join(MATERIALS))
+    generate_parser.add_argument("--directory", default="tablebases")
+    generate_parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    probe_parser = commands.add_parser("probe", help="look a position up")
+    probe_parser.add_argument("fen")
+    probe_parser.add_argument("--directory", default="tablebases")
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for material in args.materials:
+            start = time.perf_counter()
+            table = generate_table(material, args.workers)
+            write_table(table, material, args.directory)
+            longest = max(table) - 2 if max(table) > DRAW_VALUE else 0
+            print("%s: %d positions, %d wins, longest mate %d plies, %.1fs" % (
+                material, sum(1 for value in table if value), sum(1 for value in table if value > 2 and value % 2),
+                longest, time.perf_counter() - start), file=sys.stderr)
+        return 0
+    gs = ChessEngine.GameState()
+    try:
+        gs.load_fen(args.fen)
+    except ValueError as e:
+        probe_parser.error(str(e))
+    with Tablebase(args.directory) as tablebase:
+        probed = tablebase.probe(gs)
+        if probed is None:
+            print("not in the tablebases")
+            return 1
+        result, plies = probed
+        best = tablebase.best_move(gs)
+        print("%s, %d plies to mate, best move %s" % ({WIN: "win", DRAW: "draw", LOSS: "loss"}[result], plies,
+                                                        best.get_chess_notation() if best else "none"))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
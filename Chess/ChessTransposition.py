@@ -0,0 +1,92 @@
+"""
+responsible for caching results per position in a fixed size table keyed on GameState.zobrist_key,
+an entry keeps the depth it was searched to, its score, the kind of bound the score is and the best move.
+"""
+from array import array
+
+#kinds of score stored in an entry
+EXACT = 0
+LOWER_BOUND = 1 #the score is at least this (a beta cutoff)
+UPPER_BOUND = 2 #the score is at most this (no move raised alpha)
+
+#bytes used per entry by the arrays below
+ENTRY_SIZE = 8 + 4 + 1 + 1 + 2 + 1
+
+
+class TranspositionTable():
+    '''
+    size_mb bounds the memory used, the number of slots is the largest power of 2 that fits
+    '''
+    def __init__(self, size_mb=16):
+        slots = 1
+        while slots * 2 * ENTRY_SIZE <= size_mb * 1024 * 1024:
+            slots *= 2
+        self.size = slots
+        self.mask = slots - 1
+        #one array per field instead of a list of objects so memory stays fixed at size * ENTRY_SIZE
+        self.keys = array('Q', bytes(8 * slots))
+        self.scores = array('i', bytes(4 * slots))
+        self.depths = array('b', bytes(slots))
+        self.flags = array('B', bytes(slots))
+        self.moves = array('H', bytes(2 * slots)) #Move.move_id of the best move, 0 for none
+        self.ages = array('B', bytes(slots))
+        self.age = 1 #a slot with age 0 has never been written
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    '''
+    starts a new search, entries from older searches can be replaced even if they are deeper
+    '''
+    def new_search(self):
+        self.age = self.age % 255 + 1
+
+    '''
+    empties the table
+    '''
+    def clear(self):
+        slots = self.size
+        self.keys = array('Q', bytes(8 * slots))
+        self.ages = array('B', bytes(slots))
+        self.age = 1
+        self.hits = self.misses = self.stores = 0
+
+    '''
+    returns (depth, score, flag, move_id) stored for the position, or None if it is not in the table
+    '''
+    def probe(self, key):
+        i = key & self.mask
+        if self.ages[i] and self.keys[i] == key:
+            self.hits += 1
+            return self.depths[i], self.scores[i], self.flags[i], self.moves[i]
+        self.misses += 1
+        return None
+
+    '''
+    stores a result, replacing what is in the slot unless it is a deeper result for another position from this search
+    '''
+    def store(self, key, depth, score, flag, move_id=0):
+        i = key & self.mask
+        if self.ages[i] == self.age and self.keys[i] != key and self.depths[i] > depth:
+            return
+        if self.keys[i] == key and not move_id:
+            move_id = self.moves[i] #keep the best move found by an earlier search of this position
+        self.keys[i] = key
+        self.scores[i] = score
+        self.depths[i] = depth
+        self.flags[i] = flag
+        self.moves[i] = move_id
+        self.ages[i] = self.age
+        self.stores += 1
+
+    '''
+    the fraction of slots that have been written
+    '''
+    def fill_rate(self):
+        return sum(1 for age in self.ages if age) / self.size
+
+    '''
+    the bytes held by the table arrays
+    '''
+    def memory_usage(self):
+        return self.size * ENTRY_SIZE
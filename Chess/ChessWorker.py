@@ -0,0 +1,193 @@
+"""
+responsible for running the engine in a background process so the pygame loop never waits on it,
+requests and responses go over a pipe: positions as GameState.to_bytes and moves as Move.move_id.
+a new request interrupts whatever the worker is doing, so moving or undoing in the UI cancels a search straight away.
+"""
+import itertools
+import time
+from multiprocessing import Pipe, Process
+
+from Chess import ChessBook, ChessEngine, ChessSearch
+
+#the worker looks at its pipe every this many nodes to see if the search was cancelled
+INTERRUPT_CHECK_NODES = 256
+
+
+class InterruptibleSearcher(ChessSearch.Searcher):
+    '''
+    a searcher that stops as soon as a new message is waiting on the worker's end of the pipe,
+    interrupted tells a search stopped that way from one that ran out of time or nodes
+    '''
+    def __init__(self, conn, tt_size_mb=16):
+        super().__init__(tt_size_mb)
+        self.conn = conn
+        self.interrupted = False
+
+    def check_budget(self):
+        if self.nodes % INTERRUPT_CHECK_NODES == 0 and self.conn.poll():
+            self.interrupted = True
+            raise ChessSearch.SearchTimeout()
+        super().check_budget()
+
+
+class EngineResponse():
+    def __init__(self, request_id, kind, result):
+        self.request_id = request_id
+        self.kind = kind #"search", "ponder" or "valid_moves"
+        #search and ponder: (score, pv move ids, depth, nodes, seconds), valid_moves: a list of move ids
+        self.result = result
+
+    '''
+    the reply of a search as a ChessSearch.SearchResult with the moves of gs, the position the search was asked for
+    '''
+    def search_result(self, gs):
+        score, pv_ids, depth, nodes, seconds = self.result
+        pv = []
+        for move_id in pv_ids:
+            move = gs.get_valid_moves().get(move_id)
+            if move is None:
+                break
+            pv.append(move)
+            gs.make_move(move)
+        for move in pv:
+            gs.undo_move()
+        return ChessSearch.SearchResult(pv[0] if pv else None, score, pv, nodes, depth, seconds)
+
+
+'''
+the loop of the worker process: answers one request at a time until it gets "quit" or the pipe closes
+every request is (kind, request_id, ...), replies are (request_id, kind, result)
+an interrupted search is not answered, the newer request that interrupted it is
+a search is answered straight from the opening book when the position is in it
+'''
+def _worker_main(conn, tt_size_mb, book_path=None):
+    searcher = InterruptibleSearcher(conn, tt_size_mb)
+    book = ChessBook.OpeningBook(book_path) if book_path is not None else None
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError: #the UI went away
+            break
+        kind, request_id = request[0], request[1]
+        if kind == "quit":
+            break
+        if kind == "stop":
+            continue
+        gs = ChessEngine.GameState.from_bytes(request[2])
+        book_move = book.choose(gs) if kind == "search" and book is not None else None
+        if kind == "valid_moves":
+            result = [move.move_id for move in gs.get_valid_moves()]
+        elif book_move is not None:
+            result = (0, [book_move.move_id], 0, 0, 0.0)
+        else: #search or ponder
+            max_depth, time_limit, node_limit = request[3:]
+            searcher.interrupted = False
+            search = searcher.search(gs, max_depth, time_limit, node_limit)
+            if searcher.interrupted: #the request waiting on the pipe replaces this one, so its reply would be dropped
+                continue
+            result = (search.score, [move.move_id for move in search.pv], search.depth, search.nodes, search.seconds)
+        try:
+            conn.send((request_id, kind, result))
+        except (BrokenPipeError, OSError):
+            break
+
+
+class EngineWorker():
+    '''
+    the UI side of the worker process, only the reply to the latest request is ever returned by poll
+    use it as a context manager or call close
+    '''
+    def __init__(self, tt_size_mb=16, book_path=None):
+        self.conn, worker_conn = Pipe()
+        self.process = Process(target=_worker_main, args=(worker_conn, tt_size_mb, book_path), daemon=True)
+        self.process.start()
+        worker_conn.close()
+        self.request_ids = itertools.count(1)
+        self.current = None #(request_id, kind) of the request still being worked on
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    '''
+    true while a request is being worked on and its reply has not been polled yet
+    '''
+    @property
+    def busy(self):
+        return self.current is not None
+
+    @property
+    def pondering(self):
+        return self.current is not None and self.current[1] == "ponder"
+
+    def _send(self, kind, gs, *args):
+        request_id = next(self.request_ids)
+        self.conn.send((kind, request_id, gs.to_bytes()) + args)
+        self.current = (request_id, kind)
+        return request_id
+
+    '''
+    asks for the best move of gs, cancelling the current request, returns the request id
+    '''
+    def search(self, gs, max_depth=ChessSearch.MAX_PLY, time_limit=None, node_limit=None):
+        return self._send("search", gs, max_depth, time_limit, node_limit)
+
+    '''
+    thinks about gs with no limit while the opponent is choosing a move, until the next request cancels it
+    the worker keeps its transposition table, so the search that follows the opponent's move starts with the
+    replies to every move the opponent could have made already scored
+    '''
+    def ponder(self, gs, max_depth=ChessSearch.MAX_PLY):
+        return self._send("ponder", gs, max_depth, None, None)
+
+    '''
+    asks for the legal moves of gs, answered as a list of Move.move_id
+    '''
+    def valid_moves(self, gs):
+        return self._send("valid_moves", gs)
+
+    '''
+    stops the current request, its reply is dropped
+    '''
+    def cancel(self):
+        if self.current is not None:
+            self.conn.send(("stop", 0))
+            self.current = None
+
+    '''
+    returns the EngineResponse to the current request if it arrives within timeout seconds, otherwise None
+    replies to cancelled or replaced requests are read and thrown away
+    '''
+    def poll(self, timeout=0.0):
+        deadline = time.perf_counter() + timeout
+        while self.current is not None:
+            if not self.conn.poll(max(0.0, deadline - time.perf_counter())):
+                return None
+            request_id, kind, result = self.conn.recv()
+            if request_id == self.current[0]:
+                self.current = None
+                return EngineResponse(request_id, kind, result)
+        return None
+
+    '''
+    waits for the reply to the current request, for scripts that do not have an event loop
+    '''
+    def wait(self, timeout=None):
+        while self.current is not None:
+            response = self.poll(timeout if timeout is not None else 1.0)
+            if response is not None or timeout is not None:
+                return response
+        return None
+
+    def close(self):
+        if self.process.is_alive():
+            try:
+                self.conn.send(("quit", 0))
+            except (BrokenPipeError, OSError):
+                pass
+            self.process.join(1.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        self.conn.close()